@@ -0,0 +1,235 @@
+import threading
+import pyaudio
+from typing import Callable, List, Optional, Tuple
+
+
+class AudioPlayout:
+    """
+    Bounded audio playout engine feeding PyAudio in callback mode.
+
+    Synthesized PCM is written into a preallocated ring buffer. The PyAudio
+    callback pulls exactly the requested number of frames from it and pads
+    with silence when it runs dry, so no thread has to poll for audio.
+    Writers block while the ring is full, which pushes back on the
+    synthesizer instead of letting audio pile up without bounds.
+    """
+    def __init__(
+            self,
+            sample_rate: int = 24000,
+            channels: int = 1,
+            format: int = pyaudio.paInt16,
+            capacity_seconds: float = 2.0,
+            output_device_index: Optional[int] = None,
+            frames_per_buffer: int = 512):
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.format = format
+        self.output_device_index = output_device_index
+        self.frames_per_buffer = frames_per_buffer
+        self.frame_size = pyaudio.get_sample_size(format) * channels
+
+        capacity_frames = max(int(sample_rate * capacity_seconds), frames_per_buffer)
+        self.capacity = capacity_frames * self.frame_size
+        self.ring = bytearray(self.capacity)
+        self.read_pos = 0
+        self.size = 0
+
+        self.lock = threading.Lock()
+        self.space_available = threading.Condition(self.lock)
+        self.markers = []  # (byte position, callback)
+        self.playing = False
+        self.closed = True
+        self.clear_generation = 0  # bumped by clear(), writers from before stop
+
+        self.pyaudio_instance = None
+        self.pystream = None
+
+        self.underruns = 0
+        self.backpressure_waits = 0  # writes that found the ring full
+        self.bytes_written = 0
+        self.bytes_played = 0
+        self.bytes_dropped = 0
+
+    def open(self) -> None:
+        self.closed = False
+        self.pyaudio_instance = pyaudio.PyAudio()
+        self.pystream = self.pyaudio_instance.open(
+            format=self.format,
+            channels=self.channels,
+            rate=self.sample_rate,
+            output=True,
+            output_device_index=self.output_device_index,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._callback)
+        self.pystream.start_stream()
+
+    def write(self, chunk: bytes, timeout: Optional[float] = None) -> bool:
+        """
+        Append PCM data, blocking while the ring buffer is full.
+
+        Returns False if the data could not be written completely because the
+        playout was closed, cleared or the timeout expired.
+        """
+        data = memoryview(chunk).cast('B')
+        with self.lock:
+            generation = self.clear_generation
+            while len(data):
+                if self.closed or self.clear_generation != generation:
+                    return False
+                free = self.capacity - self.size
+                if free == 0:
+                    self.backpressure_waits += 1
+                    if not self.space_available.wait(timeout):
+                        return False
+                    continue
+                write_size = min(free, len(data))
+                self._copy_in(data[:write_size])
+                data = data[write_size:]
+                self.bytes_written += write_size
+                self.playing = True
+        return True
+
+    def add_marker(self, event: threading.Event) -> None:
+        """
+        Set event once every sample written so far has been handed to the
+        audio device. Uses sample counts, so it fires in the exact callback
+        that consumes the last sample.
+        """
+        self.add_callback(event.set)
+
+    def add_callback(self, callback, position: Optional[int] = None) -> None:
+        """
+        Call callback once the audio up to byte position (default: everything
+        written so far) has been consumed. Runs in the audio callback thread,
+        after the lock is released, and must return quickly. Samples dropped
+        by clear() count as consumed.
+        """
+        with self.lock:
+            if position is None:
+                position = self.bytes_written
+            due = self.bytes_played + self.bytes_dropped >= position
+            if not due:
+                self.markers.append((position, callback))
+                self.markers.sort(key=lambda marker: marker[0])
+        if due:
+            callback()
+
+    def clear(self) -> None:
+        """Drop all buffered audio immediately and release blocked writers."""
+        with self.lock:
+            self.clear_generation += 1
+            self.bytes_dropped += self.size
+            self.read_pos = 0
+            self.size = 0
+            self.playing = False
+            due = self._take_due_markers()
+            self.space_available.notify_all()
+        self._fire(due)
+
+    def positions(self) -> Tuple[int, int]:
+        """
+        Consumed and written byte positions, read together. Samples dropped
+        by clear() count as consumed, so positions taken from bytes_written
+        in earlier turns stay comparable.
+        """
+        with self.lock:
+            return self.bytes_played + self.bytes_dropped, self.bytes_written
+
+    def output_latency(self) -> float:
+        """Seconds between handing audio to the device and hearing it."""
+        if self.pystream is None:
+            return 0.0
+        return self.pystream.get_output_latency()
+
+    def buffered_samples(self) -> int:
+        with self.lock:
+            return self.size // self.frame_size
+
+    def buffered_seconds(self) -> float:
+        return self.buffered_samples() / self.sample_rate
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.size == 0
+
+    @property
+    def samples_played(self) -> int:
+        return self.bytes_played // self.frame_size
+
+    @property
+    def samples_written(self) -> int:
+        return self.bytes_written // self.frame_size
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "underruns": self.underruns,
+                "backpressure_waits": self.backpressure_waits,
+                "samples_written": self.bytes_written // self.frame_size,
+                "samples_played": self.bytes_played // self.frame_size,
+                "samples_dropped": self.bytes_dropped // self.frame_size,
+                "buffered_samples": self.size // self.frame_size,
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            self.bytes_dropped += self.size
+            self.size = 0
+            due = self._take_due_markers()
+            self.space_available.notify_all()
+        self._fire(due)
+        if self.pystream is not None:
+            self.pystream.stop_stream()
+            self.pystream.close()
+            self.pystream = None
+        if self.pyaudio_instance is not None:
+            self.pyaudio_instance.terminate()
+            self.pyaudio_instance = None
+
+    def _copy_in(self, data: memoryview) -> None:
+        write_pos = (self.read_pos + self.size) % self.capacity
+        first = min(len(data), self.capacity - write_pos)
+        self.ring[write_pos:write_pos + first] = data[:first]
+        if first < len(data):
+            self.ring[:len(data) - first] = data[first:]
+        self.size += len(data)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        wanted = frame_count * self.frame_size
+        out = bytearray(wanted)
+        with self.lock:
+            available = min(wanted, self.size)
+            if available:
+                first = min(available, self.capacity - self.read_pos)
+                out[:first] = self.ring[self.read_pos:self.read_pos + first]
+                if first < available:
+                    out[first:available] = self.ring[:available - first]
+                self.read_pos = (self.read_pos + available) % self.capacity
+                self.size -= available
+                self.bytes_played += available
+                self.space_available.notify_all()
+            due = self._take_due_markers()
+            if available < wanted and self.playing:
+                # ran dry while audio was flowing, the rest is silence;
+                # running out exactly at a marker is the expected end of a turn
+                if not (due and self.size == 0):
+                    self.underruns += 1
+                self.playing = False
+        # a callback taking the lock (or a slow one) must not hold up the writers
+        self._fire(due)
+        return bytes(out), pyaudio.paContinue
+
+    def _take_due_markers(self) -> List[Callable[[], None]]:
+        # caller holds the lock
+        due = []
+        consumed = self.bytes_played + self.bytes_dropped
+        while self.markers and self.markers[0][0] <= consumed:
+            due.append(self.markers.pop(0)[1])
+        return due
+
+    @staticmethod
+    def _fire(callbacks: List[Callable[[], None]]) -> None:
+        for callback in callbacks:
+            callback()
@@ -0,0 +1,57 @@
+from audioplayout import AudioPlayout
+from sentencequeue import Sentence, spoken_text
+
+# Checks the text recorded for an interrupted reply, over two barge-ins in
+# a row. The playout is not opened, _callback() stands in for the audio
+# device consuming frames.
+#
+#   python bargeintester.py
+
+
+def sentence(text, emotion):
+    result = Sentence(emotion)
+    result.add_text(text)
+    result.mark_finished()
+    return result
+
+
+def play(playout, byte_count):
+    playout._callback(None, byte_count // playout.frame_size, None, 0)
+
+
+def interrupt(playout, segments):
+    # what TTSHandler.interrupt() does
+    consumed, written = playout.positions()
+    playout.clear()
+    return spoken_text(segments, consumed, written)
+
+
+def check_interrupts():
+    playout = AudioPlayout(capacity_seconds=1.0)
+    playout.closed = False
+
+    # first turn, cut off after half of its only sentence
+    segments = [(playout.bytes_written, sentence("Hello there.", "happy"))]
+    playout.write(bytes(2000))
+    play(playout, 1000)
+    text = interrupt(playout, segments)
+    assert text == "[happy] Hello", f"Got: {text!r}"
+
+    # second turn, its positions continue after the 1000 dropped bytes
+    segments = [(playout.bytes_written, sentence("one two three four.", "happy"))]
+    playout.write(bytes(4000))
+    segments.append((playout.bytes_written, sentence("five six seven eight", "sad")))
+    playout.write(bytes(4000))
+    play(playout, 6000)
+    text = interrupt(playout, segments)
+    assert text == "[happy] one two three four. [sad] five six", f"Got: {text!r}"
+
+    # nothing of a third turn was played yet
+    segments = [(playout.bytes_written, sentence("Too late.", "calm"))]
+    playout.write(bytes(2000))
+    assert interrupt(playout, segments) == ""
+    print("Barge-in checks passed")
+
+
+if __name__ == "__main__":
+    check_interrupts()
@@ -1,35 +1,73 @@
-import queue
+import itertools
 import threading
-import uuid
-from typing import Generator, List, Any
+import time
+from collections import deque
+from typing import Any, Deque, Generator, List, Optional
+
+_stream_ids = itertools.count(1)
 
 class BufferStream:
-    def __init__(self):
-        self.items: queue.Queue = queue.Queue()
-        self._stop_event: threading.Event = threading.Event()
+    """
+    Buffer between a producer thread and a generator consumer (the text
+    feed of RealtimeTTS).
+
+    gen() waits on a condition variable, add() and stop() wake it at once,
+    so the generator ends as soon as stop() is called on an empty buffer.
+
+    With coalesce_window > 0 the generator merges text fragments: it joins
+    everything buffered and, if that ends inside a word, waits up to
+    coalesce_window seconds for the rest of it before yielding.
+    """
+    def __init__(self, coalesce_window: float = 0.0):
+        self.items: Deque[Any] = deque()
+        self.condition = threading.Condition(threading.Lock())
+        self._stopped_input: bool = False
         self.stopped: bool = False
-        self.stream_id: str = str(uuid.uuid4())
+        self.coalesce_window = coalesce_window
+        self.stream_id: str = str(next(_stream_ids))
 
     def add(self, item: Any) -> None:
         """Add an item to the buffer."""
-        self.items.put(item)
+        with self.condition:
+            self.items.append(item)
+            self.condition.notify()
 
     def stop(self) -> None:
-        """Signal to stop the buffer stream."""
-        self._stop_event.set()
+        """Signal to stop the buffer stream, buffered items are still yielded."""
+        with self.condition:
+            self._stopped_input = True
+            self.condition.notify()
 
     def snapshot(self) -> List[Any]:
         """Take a snapshot of all items in the buffer without exhausting it."""
-        with self.items.mutex:
-            return list(self.items.queue)
+        with self.condition:
+            return list(self.items)
+
+    def _take(self) -> Optional[Any]:
+        # caller holds the lock, items are available
+        if not self.coalesce_window:
+            return self.items.popleft()
+        deadline = time.monotonic() + self.coalesce_window
+        while True:
+            text = ''.join(self.items)
+            self.items.clear()
+            if self._stopped_input or not text or not text[-1].isalnum():
+                return text
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.condition.wait(remaining):
+                return text
+            self.items.appendleft(text)
 
     def gen(self) -> Generator[Any, None, None]:
         """Generate items from the buffer, yielding them one at a time."""
-        while not self._stop_event.is_set() or not self.items.empty():
-            try:
-                yield self.items.get(timeout=0.1)
-            except queue.Empty:
-                continue
+        while True:
+            with self.condition:
+                while not self.items and not self._stopped_input:
+                    self.condition.wait()
+                if not self.items:
+                    break
+                item = self._take()
+            yield item
         self.stopped = True
 
 # import queue
@@ -0,0 +1,108 @@
+import queue
+import random
+import threading
+import time
+from bufferstream import BufferStream
+
+# Compares the former queue.Queue based BufferStream, which polled with a
+# 100 ms timeout, with the condition variable one:
+#
+#   stop latency   time from stop() on an empty buffer to the end of gen()
+#   throughput     items per second from a producer thread through gen()
+#   coalescing     chunks handed to the consumer for a stream of LLM tokens
+#
+#   python bufferstreambenchmark.py
+
+
+class LegacyBufferStream:
+    def __init__(self):
+        self.items = queue.Queue()
+        self._stop_event = threading.Event()
+
+    def add(self, item):
+        self.items.put(item)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def gen(self):
+        while not self._stop_event.is_set() or not self.items.empty():
+            try:
+                yield self.items.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def benchmark_stop(make_buffer, runs: int = 30, seed: int = 42):
+    rng = random.Random(seed)
+    delays = []
+    for _ in range(runs):
+        buffer = make_buffer()
+        ended = []
+        thread = threading.Thread(target=lambda: (list(buffer.gen()), ended.append(time.perf_counter())))
+        thread.start()
+        buffer.add("Hello ")
+        time.sleep(rng.uniform(0.01, 0.05))  # the generator is waiting on an empty buffer
+        stop_time = time.perf_counter()
+        buffer.stop()
+        thread.join()
+        delays.append((ended[0] - stop_time) * 1000)
+    return delays
+
+
+def benchmark_throughput(make_buffer, items: int = 200000):
+    buffer = make_buffer()
+    count = 0
+
+    def produce():
+        for i in range(items):
+            buffer.add("x")
+        buffer.stop()
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=produce)
+    thread.start()
+    for _ in buffer.gen():
+        count += 1
+    thread.join()
+    return count / (time.perf_counter() - start)
+
+
+def benchmark_coalescing(coalesce_window: float, tokens: int = 300, seed: int = 42):
+    rng = random.Random(seed)
+    buffer = BufferStream(coalesce_window)
+    chunks = []
+    thread = threading.Thread(target=lambda: chunks.extend(buffer.gen()))
+    thread.start()
+    text = ""
+    for i in range(tokens):
+        # word pieces as a BPE tokenizer emits them, a few ms apart
+        token = rng.choice([" the", " conv", "ers", "ation", " is", " fun", ".", " Sure", "ly", ","])
+        text += token
+        buffer.add(token)
+        time.sleep(rng.uniform(0.001, 0.01))
+    buffer.stop()
+    thread.join()
+    assert ''.join(chunks) == text
+    return len(chunks), len(text) / len(chunks)
+
+
+if __name__ == "__main__":
+    print("Stop latency, stop() on an empty buffer to the end of gen():")
+    for name, make_buffer in (("queue 100 ms", LegacyBufferStream), ("condition", BufferStream)):
+        delays = benchmark_stop(make_buffer)
+        print(f"  {name:13s} p50 {percentile(delays, 0.5):8.3f} ms   p95 {percentile(delays, 0.95):8.3f} ms")
+
+    print("\nThroughput:")
+    for name, make_buffer in (("queue 100 ms", LegacyBufferStream), ("condition", BufferStream)):
+        print(f"  {name:13s} {benchmark_throughput(make_buffer):10.0f} items/s")
+
+    print("\nCoalescing, 300 LLM tokens:")
+    for window in (0.0, 0.02):
+        chunks, chunk_length = benchmark_coalescing(window)
+        print(f"  window {window * 1000:4.0f} ms  {chunks:4d} chunks, {chunk_length:5.1f} characters per chunk")
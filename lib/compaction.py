@@ -0,0 +1,110 @@
+import threading
+import time
+from typing import Dict, Optional
+
+SUMMARY_PROMPT = (
+    "You keep the memory of an ongoing spoken conversation. Merge the current memory and the "
+    "new conversation excerpt into one compact memory that lets the assistant continue the "
+    "conversation in character. Keep names, facts about both speakers, promises, open "
+    "questions, the relationship and the emotional tone. Write plain sentences in third "
+    "person, at most {words} words, no preamble."
+)
+
+
+class HistoryCompactor:
+    """
+    Folds the oldest part of the conversation into a short memory block
+    instead of dropping it.
+
+    start() is called when the assistant is idle (after playback). If the
+    prompt exceeds compact_at_tokens, the oldest messages beyond
+    keep_tokens of recent history are summarized together with the current
+    memory by a separate handler of the same provider in a background
+    thread. The result replaces those messages in the Conversation. A new
+    turn cancels a running compaction, it is retried after that turn.
+    """
+    def __init__(
+            self,
+            llm_handler,
+            summary_handler,
+            compact_at_tokens: int = 1200,
+            keep_tokens: int = 500,
+            memory_max_tokens: int = 250):
+
+        self.conversation = llm_handler.conversation
+        self.summary_handler = summary_handler
+        self.summary_handler.trace = False  # runs beside the turns, keep it out of their traces
+        self.compact_at_tokens = compact_at_tokens
+        self.keep_tokens = keep_tokens
+        self.memory_max_tokens = memory_max_tokens
+
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.cancelled = threading.Event()
+
+        self.stats = {
+            "compactions": 0,
+            "compacted_messages": 0,
+            "cancelled": 0,
+            "last_saved_tokens": 0,
+            "last_duration": 0.0,
+        }
+
+    def needs_compaction(self, system_prompt: str) -> bool:
+        usage = self.conversation.token_usage(self.conversation.with_memory(system_prompt))
+        return usage["total_tokens"] > self.compact_at_tokens
+
+    def start(self, system_prompt: str) -> bool:
+        """Compact in the background if the prompt is over the threshold."""
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            if not self.needs_compaction(system_prompt):
+                return False
+            self.cancelled.clear()
+            self.summary_handler.begin_turn()
+            self.thread = threading.Thread(target=self._compact, daemon=True)
+            self.thread.start()
+            return True
+
+    def cancel(self) -> None:
+        """Abort a running compaction, the history stays as it is."""
+        with self.lock:
+            thread = self.thread
+            if thread is None or not thread.is_alive():
+                return
+            self.cancelled.set()
+            self.summary_handler.cancel()
+        thread.join()
+        self.stats["cancelled"] += 1
+
+    def get_turn_stats(self) -> Dict:
+        usage = self.conversation.token_usage()
+        return {
+            "history_tokens": usage["history_tokens"],
+            "memory_tokens": self.conversation.memory_tokens,
+            "compactions": self.stats["compactions"],
+        }
+
+    def _compact(self) -> None:
+        start_time = time.time()
+        message_ids, messages = self.conversation.oldest_messages(self.keep_tokens)
+        if not messages:
+            return
+
+        excerpt = '\n'.join(f"{role}: {message}" for role, message in messages)
+        request = f"Current memory:\n{self.conversation.memory or '(empty)'}\n\nNew conversation excerpt:\n{excerpt}"
+        words = int(self.memory_max_tokens * 0.75)
+
+        handler = self.summary_handler
+        handler.conversation.clear_history()
+        handler.add_user_text(request)
+        memory = handler.generate_response(SUMMARY_PROMPT.format(words=words)).strip()
+        if self.cancelled.is_set() or not memory:
+            return
+
+        saved_tokens = self.conversation.apply_compaction(message_ids, memory)
+        self.stats["compactions"] += 1
+        self.stats["compacted_messages"] += len(message_ids)
+        self.stats["last_saved_tokens"] = saved_tokens
+        self.stats["last_duration"] = time.time() - start_time
@@ -1,51 +1,221 @@
 import logging
-from typing import List, Tuple
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
 
 class Conversation:
-    def __init__(self, max_tokens: int = 1548, debug = False):
+    """
+    Chat history with incremental token accounting.
+
+    Every message is counted once when it is added, the running total makes
+    truncation a pop of the oldest messages instead of a re-count of the
+    whole history on every turn.
+
+    Truncation evicts in blocks with hysteresis: once the budget is
+    exceeded, old messages go until the prompt is down to evict_to of the
+    budget. Between evictions the prompt only grows at its end, so servers
+    can reuse their KV / prompt cache for everything sent before.
+
+    An optional memory block (see lib/compaction.py) holds a summary of
+    older turns and is sent as part of the system prompt.
+    """
+    def __init__(
+            self,
+            max_tokens: int = 1548,
+            debug = False,
+            count_tokens_func: Optional[Callable[[str], int]] = None,
+            evict_to: float = 0.6):
+
         self.debug = debug
-        self.history: List[Tuple[str, str]] = []
+        self.lock = threading.RLock()  # a background compaction edits the front
+        self.history: Deque[Tuple[str, str]] = deque()
+        self.token_counts: Deque[int] = deque()
+        self.message_ids: Deque[int] = deque()
+        self.next_id = 0
+        self.history_tokens = 0
         self.max_tokens = max_tokens
+        self.evict_to = evict_to
+        self.count_tokens_func = count_tokens_func
+        self.system_prompt = None
+        self.system_tokens = 0
+        self.memory = ""
+        self.memory_tokens = 0
+
+        # prompt of the previous request, to measure the shared prefix
+        self.sent_system_prompt = None
+        self.sent_ids: Tuple[int, ...] = ()
+        self.cache_stats = {
+            "evictions": 0,
+            "evicted_messages": 0,
+            "last_prefix_reuse": 0.0,
+        }
+
+    def set_token_counter(self, count_tokens_func: Callable[[str], int]):
+        """Switch the tokenizer, messages already in the history are counted again."""
+        self.count_tokens_func = count_tokens_func
+        self.system_prompt = None
+        self.token_counts = deque(count_tokens_func(message) for _, message in self.history)
+        self.history_tokens = sum(self.token_counts)
 
     def add_user_message(self, text: str):
-        self.history.append(("user", text))
+        self.add_message("user", text)
 
     def add_assistant_message(self, text: str):
-        self.history.append(("assistant", text))
+        self.add_message("assistant", text)
+
+    def add_message(self, role: str, text: str):
+        tokens = self.count_tokens_func(text) if self.count_tokens_func else 0
+        with self.lock:
+            self.history.append((role, text))
+            self.token_counts.append(tokens)
+            self.message_ids.append(self.next_id)
+            self.next_id += 1
+            self.history_tokens += tokens
+
+    def pop_message(self) -> Tuple[str, str]:
+        with self.lock:
+            self.history_tokens -= self.token_counts.pop()
+            self.message_ids.pop()
+            return self.history.pop()
 
-    def get_history(self) -> List[Tuple[str, str]]:
+    def _evict_oldest(self) -> int:
+        self.history.popleft()
+        self.message_ids.popleft()
+        tokens = self.token_counts.popleft()
+        self.history_tokens -= tokens
+        return tokens
+
+    def get_history(self) -> Deque[Tuple[str, str]]:
         return self.history
 
     def clear_history(self):
-        self.history.clear()
+        with self.lock:
+            self.history.clear()
+            self.token_counts.clear()
+            self.message_ids.clear()
+            self.history_tokens = 0
+            self.memory = ""
+            self.memory_tokens = 0
+
+    def with_memory(self, system_prompt: str) -> str:
+        """The system prompt with the memory block of compacted turns appended."""
+        if not self.memory:
+            return system_prompt
+        return f"{system_prompt}\n\nMemory of the earlier conversation:\n{self.memory}"
+
+    def oldest_messages(self, keep_tokens: int) -> Tuple[List[int], List[Tuple[str, str]]]:
+        """
+        Ids and messages from the front of the history that are not needed
+        to keep keep_tokens of recent history. The rest starts with a user
+        message and is never empty.
+        """
+        with self.lock:
+            count = 0
+            remaining = self.history_tokens
+            while count < len(self.history) - 1 and (
+                    remaining > keep_tokens or self.history[count][0] != "user"):
+                remaining -= self.token_counts[count]
+                count += 1
+            while count and self.history[count][0] != "user":
+                count -= 1
+            return list(self.message_ids)[:count], list(self.history)[:count]
+
+    def apply_compaction(self, message_ids: List[int], memory: str) -> int:
+        """
+        Replace the given front messages by the new memory block. Messages
+        evicted meanwhile are skipped. Returns the prompt tokens saved.
+        """
+        with self.lock:
+            removed_tokens = 0
+            for message_id in message_ids:
+                if not self.message_ids or self.message_ids[0] > message_id:
+                    continue
+                if self.message_ids[0] != message_id:
+                    break
+                removed_tokens += self._evict_oldest()
+            memory_tokens = self.count_tokens_func(memory) if self.count_tokens_func else 0
+            saved_tokens = removed_tokens - (memory_tokens - self.memory_tokens)
+            self.memory = memory
+            self.memory_tokens = memory_tokens
+            return saved_tokens
+
+    def count_system_tokens(self, system_prompt: str) -> int:
+        # the system prompt rarely changes, count it once per prompt
+        if system_prompt != self.system_prompt:
+            self.system_prompt = system_prompt
+            self.system_tokens = self.count_tokens_func(system_prompt)
+        return self.system_tokens
+
+    def token_usage(self, system_prompt: Optional[str] = None) -> Dict[str, float]:
+        if system_prompt is not None and self.count_tokens_func:
+            self.count_system_tokens(system_prompt)
+        total_tokens = self.system_tokens + self.history_tokens
+        return {
+            "system_tokens": self.system_tokens,
+            "history_tokens": self.history_tokens,
+            "total_tokens": total_tokens,
+            "max_tokens": self.max_tokens,
+            "remaining_tokens": self.max_tokens - total_tokens,
+            "messages": len(self.history),
+            "fill_percentage": (total_tokens / self.max_tokens) * 100,
+        }
+
+    def measure_prefix_reuse(self, system_prompt: str) -> float:
+        """
+        Share of this prompt's tokens that the previous request already sent
+        as an identical prefix (system prompt plus leading messages). Call
+        once per request, after truncate_history().
+        """
+        ids = tuple(self.message_ids)
+        reused_tokens = 0
+        if system_prompt == self.sent_system_prompt:
+            reused_tokens = self.count_system_tokens(system_prompt)
+            for i, (message_id, sent_id) in enumerate(zip(ids, self.sent_ids)):
+                if message_id != sent_id:
+                    break
+                reused_tokens += self.token_counts[i]
+        total_tokens = self.count_system_tokens(system_prompt) + self.history_tokens
+
+        self.sent_system_prompt = system_prompt
+        self.sent_ids = ids
+        reuse = reused_tokens / total_tokens if total_tokens else 0.0
+        self.cache_stats["last_prefix_reuse"] = reuse
+        return reuse
 
-    def truncate_history(self, system_prompt: str, count_tokens_func):
-        system_tokens = count_tokens_func(system_prompt)
-        total_tokens = system_tokens
-        truncated_history = []
+    def truncate_history(self, system_prompt: str, count_tokens_func: Optional[Callable[[str], int]] = None):
+        if count_tokens_func is not None and count_tokens_func != self.count_tokens_func:
+            self.set_token_counter(count_tokens_func)
 
-        for role, message in reversed(self.history):
-            message_tokens = count_tokens_func(message)
-            if total_tokens + message_tokens <= self.max_tokens:
-                truncated_history.insert(0, (role, message))
-                total_tokens += message_tokens
-            else:
-                break
+        with self.lock:
+            return self._truncate_history(system_prompt)
 
-        removed_messages = len(self.history) - len(truncated_history)
-        self.history = truncated_history
+    def _truncate_history(self, system_prompt: str):
+        system_tokens = self.count_system_tokens(system_prompt)
+        total_tokens = system_tokens + self.history_tokens
 
-        # Log token usage information
-        history_tokens = total_tokens - system_tokens
-        fill_percentage = (total_tokens / self.max_tokens) * 100
+        removed_messages = 0
+        if total_tokens > self.max_tokens:
+            # evict a whole block down to the low watermark, so the prefix
+            # stays stable for the next turns instead of shifting every turn
+            low_watermark = self.max_tokens * self.evict_to
+            while self.history and total_tokens > low_watermark:
+                total_tokens -= self._evict_oldest()
+                removed_messages += 1
+            # start the history with a user message, as chat templates expect
+            while self.history and self.history[0][0] != "user":
+                total_tokens -= self._evict_oldest()
+                removed_messages += 1
+            self.cache_stats["evictions"] += 1
+            self.cache_stats["evicted_messages"] += removed_messages
 
         if self.debug:
-            print(f"Token usage: {total_tokens}/{self.max_tokens} ({fill_percentage:.2f}%)")
+            usage = self.token_usage()
+            print(f"Token usage: {usage['total_tokens']}/{self.max_tokens} ({usage['fill_percentage']:.2f}%)")
             print(f"System prompt tokens: {system_tokens}")
-            print(f"History tokens: {history_tokens}")
-            print(f"Remaining tokens for response: {self.max_tokens - total_tokens}")
+            print(f"History tokens: {self.history_tokens}")
+            print(f"Remaining tokens for response: {usage['remaining_tokens']}")
 
             if removed_messages > 0:
                 print(f"History truncated. {removed_messages} messages removed.")
 
-        return total_tokens
\ No newline at end of file
+        return total_tokens
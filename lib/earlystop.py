@@ -0,0 +1,124 @@
+import re
+from typing import Callable, Dict, List, Optional
+from lib.textstream import StreamEvent
+
+# a sentence terminator, closing quotes or brackets, then whitespace
+_SENTENCE_END = re.compile(r'[.!?…]+["\'”’)]*(?=\s)')
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "vs", "e.g", "i.e"}
+
+
+class EarlyStopController:
+    """
+    Stops a reply once it has the structure the system prompt asks for,
+    max_pairs [emotion] sentence pairs, instead of reading the stream to
+    its end.
+
+    Sits between EmotionTextStream and the consumer: filter() passes the
+    parsed events through until the last allowed sentence is complete, that
+    is a terminator followed by whitespace or the tag of one more pair.
+    Everything after that point is dropped and stopped turns True, the
+    caller then cancels the LLM request.
+
+    With stop=False (observe mode) nothing is dropped, the tokens after the
+    stop point are only counted, which measures what stopping would save.
+    When stopping, the tokens after the stop point are the overrun that
+    arrived before the cancel took effect, generated for nothing.
+    """
+    def __init__(
+            self,
+            max_pairs: int = 4,
+            stop: bool = True,
+            count_tokens: Optional[Callable[[str], int]] = None):
+
+        self.max_pairs = max_pairs
+        self.stop = stop
+        self.count_tokens = count_tokens or (lambda text: len(text.split()))
+        self.stats = {
+            "stopped_turns": 0,
+            "overrun_tokens": 0,
+        }
+        self.reset()
+
+    def reset(self) -> None:
+        self.pairs = 0
+        self.pair_text = ""
+        self.stopped = False
+        self.parts: List[str] = []
+        self.overrun_parts: List[str] = []
+
+    def filter(self, events: List[StreamEvent]) -> List[StreamEvent]:
+        """Return the events before the stop point."""
+        accepted: List[StreamEvent] = []
+        for text, emotion in events:
+            if self.stopped:
+                self.overrun_parts.append(text if emotion is None else f"[{emotion}] ")
+                if not self.stop:
+                    accepted.append((text, emotion))
+                continue
+
+            if emotion is not None:
+                if self.pairs >= self.max_pairs and self.pair_text.strip():
+                    # one pair too many, the last one is complete
+                    self._stop()
+                    self.overrun_parts.append(f"[{emotion}] ")
+                    if not self.stop:
+                        accepted.append((text, emotion))
+                    continue
+                self.pairs += 1
+                self.pair_text = ""
+                self.parts.append(f"[{emotion}] ")
+                accepted.append((text, emotion))
+                continue
+
+            cut = self._sentence_end(text) if self.pairs >= self.max_pairs else None
+            if cut is None:
+                self.pair_text += text
+                self.parts.append(text)
+                accepted.append((text, emotion))
+                continue
+
+            head, tail = text[:cut], text[cut:]
+            self.pair_text += head
+            self.parts.append(head)
+            self._stop()
+            self.overrun_parts.append(tail)
+            if self.stop:
+                if head:
+                    accepted.append((head, None))
+            else:
+                accepted.append((text, emotion))
+        return accepted
+
+    def _sentence_end(self, text: str) -> Optional[int]:
+        """Offset in text just after the terminator of the pair's sentence, if it ends in there."""
+        pair_text = self.pair_text + text
+        for match in _SENTENCE_END.finditer(pair_text):
+            if match.end() < len(self.pair_text):
+                continue  # seen before, an abbreviation
+            words = pair_text[:match.start()].split()
+            if match.group()[0] == '.' and words and words[-1].lower() in _ABBREVIATIONS:
+                continue
+            return match.end() - len(self.pair_text)
+        return None
+
+    def _stop(self) -> None:
+        self.stopped = True
+        self.stats["stopped_turns"] += 1
+
+    def text(self) -> str:
+        """The reply up to the stop point, for the history."""
+        return ''.join(self.parts).strip()
+
+    def turn_stats(self) -> Dict:
+        """
+        overrun_tokens counts what came in after the stop point. In observe
+        mode that is what stopping would have saved, when stopping it is
+        what was already on its way before the cancel took effect.
+        """
+        overrun_tokens = self.count_tokens(''.join(self.overrun_parts).strip()) if self.stopped else 0
+        self.stats["overrun_tokens"] += overrun_tokens
+        return {
+            "pairs": self.pairs,
+            "early_stop": self.stopped,
+            "overrun_tokens": overrun_tokens,
+        }
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional
+import numpy as np
+
+GPT_COND_LATENT_SHAPE = (-1, 1024)
+
+# Packed on-disk format: all latents of a references folder live in one flat
+# float16 .npy array that is memory-mapped on load, the index json holds the
+# offsets and content hashes of every emotion voice.
+LATENT_ARCHIVE_FILE = "latents.npy"
+LATENT_INDEX_FILE = "latents_index.json"
+LATENT_ARCHIVE_VERSION = 1
+
+
+def file_hash(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class EmotionLatents:
+    """Speaker conditioning of one emotion voice."""
+    def __init__(self, emotion: str, reference: str, gpt_cond_latent: Optional[np.ndarray] = None,
+                 speaker_embedding: Optional[np.ndarray] = None):
+        self.emotion = emotion
+        self.reference = reference  # file handed to the TTS engine
+        self.gpt_cond_latent = gpt_cond_latent
+        self.speaker_embedding = speaker_embedding
+
+    def has_latents(self) -> bool:
+        return self.gpt_cond_latent is not None and self.speaker_embedding is not None
+
+    def to_json_dict(self) -> Dict[str, list]:
+        """Latents in the json layout the coqui engine reads."""
+        return {
+            "gpt_cond_latent": np.asarray(self.gpt_cond_latent, dtype=np.float16).tolist(),
+            "speaker_embedding": np.asarray(self.speaker_embedding, dtype=np.float16).tolist(),
+        }
+
+    def __repr__(self):
+        return f"EmotionLatents(emotion='{self.emotion}', reference='{self.reference}')"
+
+
+def load_latent_index(references_folder: str) -> Dict[str, dict]:
+    index_path = os.path.join(references_folder, LATENT_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r') as f:
+        index = json.load(f)
+    if index.get("version") != LATENT_ARCHIVE_VERSION:
+        return {}
+    return index.get("emotions", {})
+
+
+def save_latent_archive(references_folder: str, entries: List[EmotionLatents], hashes: Dict[str, str]) -> None:
+    """Write all latents into the packed archive plus its index."""
+    arrays = []
+    index = {}
+    offset = 0
+    for latents in entries:
+        gpt_cond_latent = np.asarray(latents.gpt_cond_latent, dtype=np.float16)
+        speaker_embedding = np.asarray(latents.speaker_embedding, dtype=np.float16).ravel()
+        index[latents.emotion] = {
+            "offset": offset,
+            "gpt_cond_latent_shape": list(gpt_cond_latent.shape),
+            "speaker_embedding_size": int(speaker_embedding.size),
+            "wav_hash": hashes.get(latents.emotion, ""),
+        }
+        arrays.append(gpt_cond_latent.ravel())
+        arrays.append(speaker_embedding)
+        offset += gpt_cond_latent.size + speaker_embedding.size
+
+    archive = np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.float16)
+
+    # write to temp files first so a running chat never maps a half written archive
+    archive_path = os.path.join(references_folder, LATENT_ARCHIVE_FILE)
+    index_path = os.path.join(references_folder, LATENT_INDEX_FILE)
+    with open(archive_path + ".tmp", 'wb') as f:
+        np.save(f, archive)
+    with open(index_path + ".tmp", 'w') as f:
+        json.dump({"version": LATENT_ARCHIVE_VERSION, "dtype": "float16", "emotions": index}, f, indent=4)
+    os.replace(archive_path + ".tmp", archive_path)
+    os.replace(index_path + ".tmp", index_path)
+
+
+class EmotionLatentCache:
+    """
+    Resolves the emotion voices in the references folder once, keyed by
+    emotion: the precomputed .json of a voice when there is one, else its wav.
+
+    The coqui engine keeps the conditioning in its worker process and only
+    accepts a reference file, so at runtime only the paths are kept. With
+    with_latents=True (precompute_latents.py) the latents themselves are
+    loaded too, from the packed archive when available (memory-mapped, no
+    copies), otherwise from the per voice .json.
+    """
+    def __init__(self, references_folder: str, default_emotion: str = "neutral"):
+        self.references_folder = references_folder
+        self.default_emotion = default_emotion
+        self.entries: Dict[str, EmotionLatents] = {}
+        self.archive: Optional[np.ndarray] = None
+        self.load_time: float = 0.0
+
+    def load(self, with_latents: bool = False) -> None:
+        start_time = time.time()
+        index = load_latent_index(self.references_folder) if with_latents else {}
+        archive_path = os.path.join(self.references_folder, LATENT_ARCHIVE_FILE)
+        self.archive = np.load(archive_path, mmap_mode='r') if index and os.path.exists(archive_path) else None
+
+        entries = {}
+        for file in sorted(os.listdir(self.references_folder)):
+            emotion, extension = os.path.splitext(file)
+            if extension != ".wav":
+                continue
+            wav_path = os.path.join(self.references_folder, file)
+            json_path = os.path.join(self.references_folder, emotion + ".json")
+            # without a .json the engine computes the latents from the wav
+            reference = json_path if os.path.exists(json_path) else wav_path
+            if not with_latents:
+                entries[emotion] = EmotionLatents(emotion, reference)
+            elif self.archive is not None and emotion in index:
+                entries[emotion] = self.load_archive_entry(emotion, reference, index[emotion])
+            elif os.path.exists(json_path):
+                entries[emotion] = self.load_json(emotion, json_path)
+            else:
+                entries[emotion] = EmotionLatents(emotion, wav_path)
+        self.entries = entries
+        self.load_time = time.time() - start_time
+
+    def load_archive_entry(self, emotion: str, reference: str, entry: dict) -> EmotionLatents:
+        offset = entry["offset"]
+        gpt_shape = tuple(entry["gpt_cond_latent_shape"])
+        gpt_size = int(np.prod(gpt_shape))
+        speaker_size = entry["speaker_embedding_size"]
+        # slices of the memory map are views, nothing is read until used
+        gpt_cond_latent = self.archive[offset:offset + gpt_size].reshape(gpt_shape)
+        speaker_embedding = self.archive[offset + gpt_size:offset + gpt_size + speaker_size]
+        return EmotionLatents(emotion, reference, gpt_cond_latent, speaker_embedding)
+
+    @staticmethod
+    def load_json(emotion: str, json_path: str) -> EmotionLatents:
+        with open(json_path, 'r') as f:
+            latents = json.load(f)
+        gpt_cond_latent = np.asarray(latents["gpt_cond_latent"], dtype=np.float16).reshape(GPT_COND_LATENT_SHAPE)
+        speaker_embedding = np.asarray(latents["speaker_embedding"], dtype=np.float16)
+        return EmotionLatents(emotion, json_path, gpt_cond_latent, speaker_embedding)
+
+    def emotions(self) -> List[str]:
+        return list(self.entries.keys())
+
+    def get(self, emotion: Optional[str]) -> Optional[EmotionLatents]:
+        """Return the latents for emotion, falling back to the default emotion."""
+        if emotion and emotion in self.entries:
+            return self.entries[emotion]
+        return self.entries.get(self.default_emotion)
+
+    def __contains__(self, emotion: str) -> bool:
+        return emotion in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,135 @@
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+class FragmentSizer:
+    """
+    Chooses the fragment sizes of a turn from how fast the TTS engine
+    actually is, instead of fixed character counts.
+
+    Until min_samples units were measured the configured sizes are used.
+    Every synthesized unit adds a sample: its characters, audio duration,
+    synthesis time and the time to its first chunk (the fixed startup
+    latency L). Over a rolling window that gives the real-time factor RTF
+    (synthesis time after the first chunk / audio time) and the speech rate in characters per
+    second.
+
+    The first fragment is sized for the earliest start: it only has to play
+    for the startup latency L of the next unit, d >= L, which keeps it
+    short even on a slow engine.
+
+    Later units have to hide their own synthesis as well. While a unit of d
+    seconds plays, the engine synthesizes the rest of it and then needs L
+    until the next unit's first chunk, so playback continues without a gap
+    if d >= L / (1 - RTF). The minimum sentence length is sized to that.
+    With RTF >= 1 streaming can not keep up and the largest units are used.
+    Both sizes get a safety margin.
+
+    The queue depth of the last turn corrects the margin of the later
+    units: gaps at their handovers (no audio buffered) raise it, a large
+    minimum slack lowers it.
+    """
+    def __init__(
+            self,
+            first_fragment_chars: int = 10,
+            min_chars: int = 10,
+            floor_chars: int = 5,
+            max_first_chars: int = 120,
+            max_chars: int = 150,
+            window: int = 20,
+            min_samples: int = 3,
+            margin: float = 1.2,
+            max_margin: float = 3.0,
+            comfortable_slack: float = 1.0):
+
+        self.default_first_chars = first_fragment_chars
+        self.default_min_chars = min_chars
+        self.floor_chars = floor_chars  # shorter units sound clipped
+        self.max_first_chars = max_first_chars
+        self.max_chars = max_chars
+        self.min_samples = min_samples
+        self.margin = margin
+        self.min_margin = margin
+        self.max_margin = max_margin
+        self.comfortable_slack = comfortable_slack
+        # (chars, audio seconds, synthesis seconds, first chunk seconds)
+        self.samples: Deque[Tuple[int, float, float, float]] = deque(maxlen=window)
+        self.turn_handovers = 0
+        self.turn_gaps = 0
+        self.turn_min_slack: Optional[float] = None
+        self.decision: Dict = {}
+
+    def add_synthesis(self, chars: int, audio_seconds: float, synthesis_seconds: float, first_chunk_seconds: float) -> None:
+        if chars > 0 and audio_seconds > 0:
+            self.samples.append((chars, audio_seconds, synthesis_seconds, first_chunk_seconds))
+
+    def add_handover(self, slack: float) -> None:
+        """Audio buffered ahead when the next unit's first chunk arrived."""
+        self.turn_handovers += 1
+        if self.turn_handovers == 1:
+            return  # after the first fragment, which is not sized to avoid gaps
+        if slack == 0.0:
+            self.turn_gaps += 1
+        if self.turn_min_slack is None or slack < self.turn_min_slack:
+            self.turn_min_slack = slack
+
+    def measurements(self) -> Optional[Dict[str, float]]:
+        if len(self.samples) < self.min_samples:
+            return None
+        chars = sum(sample[0] for sample in self.samples)
+        audio = sum(sample[1] for sample in self.samples)
+        # streaming rate after the first chunk, the startup is in latency
+        synthesis = sum(sample[2] - sample[3] for sample in self.samples)
+        latencies = sorted(sample[3] for sample in self.samples)
+        return {
+            "rtf": synthesis / audio,
+            "latency": latencies[len(latencies) // 2],
+            "chars_per_second": chars / audio,
+        }
+
+    def choose(self) -> Dict:
+        """Decide the sizes for the next turn, returns them with what they are based on."""
+        self._adjust_margin()
+        self.turn_handovers = 0
+        self.turn_gaps = 0
+        self.turn_min_slack = None
+
+        measured = self.measurements()
+        if measured is None:
+            self.decision = {
+                "first_fragment_chars": self.default_first_chars,
+                "min_sentence_chars": self.default_min_chars,
+                "fragment_sizing": "default",
+            }
+            return self.decision
+
+        rtf = measured["rtf"]
+        chars_per_second = measured["chars_per_second"]
+        # the first fragment only covers the startup of the next unit, the
+        # margin raised for gaps between later units does not apply to it
+        first_chars = int(measured["latency"] * self.min_margin * chars_per_second)
+        if rtf < 1.0:
+            # seconds of audio a later unit needs to cover the synthesis and
+            # startup of the next one
+            needed = measured["latency"] / (1.0 - rtf)
+            min_chars = int(needed * self.margin * chars_per_second)
+            sizing = "rtf"
+        else:
+            min_chars = self.max_chars
+            sizing = "slow"
+
+        self.decision = {
+            "first_fragment_chars": max(self.floor_chars, min(first_chars, self.max_first_chars)),
+            "min_sentence_chars": max(self.floor_chars, min(min_chars, self.max_chars)),
+            "fragment_sizing": sizing,
+            "tts_rtf": round(rtf, 3),
+            "tts_latency": round(measured["latency"], 3),
+            "fragment_margin": round(self.margin, 2),
+        }
+        return self.decision
+
+    def _adjust_margin(self) -> None:
+        if self.turn_gaps:
+            self.margin = min(self.margin * 1.25, self.max_margin)
+        elif self.turn_min_slack is not None and self.turn_min_slack > self.comfortable_slack:
+            self.margin = max(self.margin * 0.9, self.min_margin)
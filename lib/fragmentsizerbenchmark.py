@@ -0,0 +1,109 @@
+import random
+from fragmentsizer import FragmentSizer
+from segmenter import SentenceSegmenter
+
+# Fixed fragment sizes against FragmentSizer, on a simulated TTS engine in
+# virtual time. The engine synthesizes units one after the other, the
+# first chunk of a unit comes after a fixed latency, the rest at the
+# engine's real-time factor. Per engine speed and sizing:
+#
+#   first audio  first token to the first audio chunk
+#   stall        playback time lost to underruns over the turn
+#   sizes        first fragment / min sentence chars of the last turn
+#
+#   python fragmentsizerbenchmark.py
+
+REPLIES = [
+    "Oh, hello there! It's so nice to see you again, I was hoping you'd stop by. "
+    "So tell me, what have you been up to lately? "
+    "I just finished reading the most amazing book, you would love it. "
+    "But first, let's get you something warm to drink.",
+    "Hey you, come in! The kettle just boiled, so you're right on time. "
+    "Sit down, make yourself at home, and tell me everything about the trip.",
+    "Right, I see. That sounds like a long day, and honestly you handled it better than most would. "
+    "Get some rest tonight, tomorrow will look different.",
+]
+CHARS_PER_SECOND = 15.0  # speech rate of the voice
+
+# (name, real-time factor, first chunk latency)
+ENGINES = [
+    ("fast GPU", 0.15, 0.10),
+    ("slow GPU", 0.6, 0.35),
+    ("CPU only", 0.9, 0.8),
+]
+
+
+def make_stream(reply, rng):
+    tokens = []
+    now = 0.0
+    pos = 0
+    while pos < len(reply):
+        size = rng.randint(1, 6)
+        now += rng.uniform(0.01, 0.04)
+        tokens.append((now, reply[pos:pos + size]))
+        pos += size
+    return tokens
+
+
+def segment(tokens, segmenter):
+    segmenter.reset()
+    units = []
+    for at, token in tokens:
+        units.extend((at, text) for text, _ in segmenter.feed(token))
+    units.extend((tokens[-1][0], text) for text, _ in segmenter.flush())
+    return units
+
+
+def play(units, rtf, latency, sizer=None):
+    """Returns first audio time and stall seconds, feeds the sizer like TTSHandler does."""
+    done = 0.0
+    play_end = None
+    first_audio = None
+    stall = 0.0
+    for ready, text in units:
+        duration = len(text) / CHARS_PER_SECOND
+        start = max(ready, done)
+        first_chunk = start + latency
+        done = first_chunk + rtf * duration
+        if first_audio is None:
+            first_audio = first_chunk
+            play_start = first_chunk
+        else:
+            if sizer:
+                sizer.add_handover(max(0.0, play_end - first_chunk))
+            stall += max(0.0, first_chunk - play_end)
+            play_start = max(first_chunk, play_end)
+        # with rtf > 1 the unit runs dry while it plays
+        play_end = max(play_start + duration, done)
+        stall += play_end - (play_start + duration)
+        if sizer:
+            sizer.add_synthesis(len(text), duration, done - start, latency)
+    return first_audio, stall
+
+
+def run_benchmark(turns: int = 30, seed: int = 42):
+    print(f"{'engine':10s} {'sizing':9s} {'first audio':>12s} {'stall/turn':>11s} {'sizes':>8s}")
+    for name, rtf, latency in ENGINES:
+        for adaptive in (False, True):
+            rng = random.Random(seed)
+            segmenter = SentenceSegmenter()
+            sizer = FragmentSizer() if adaptive else None
+            first_audio, stall = [], 0.0
+            for turn in range(turns):
+                if sizer:
+                    decision = sizer.choose()
+                    segmenter.first_fragment_chars = decision["first_fragment_chars"]
+                    segmenter.min_chars = decision["min_sentence_chars"]
+                tokens = make_stream(REPLIES[turn % len(REPLIES)], rng)
+                first, turn_stall = play(segment(tokens, segmenter), rtf, latency, sizer)
+                first_audio.append(first - tokens[0][0])
+                stall += turn_stall
+            # the steady state, after the sizer has its samples
+            first_audio = sorted(first_audio[turns // 2:])
+            sizes = f"{segmenter.first_fragment_chars}/{segmenter.min_chars}"
+            print(f"{name:10s} {'adaptive' if adaptive else 'fixed 10':9s} "
+                  f"{first_audio[len(first_audio) // 2] * 1000:9.0f} ms {stall / turns * 1000:8.0f} ms {sizes:>8s}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,309 @@
+import bisect
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from lib.turntrace import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram:
+    """
+    Time-to-first-token histogram with log spaced buckets from 10 ms to
+    about 60 s (each bucket 20% wider than the one before). Percentiles are
+    read as the upper bound of the bucket they fall into.
+
+    Attempts cancelled before their first token are censored samples: their
+    TTFT is only known to be longer than the time they ran. They are kept
+    apart and enter the percentiles as a Kaplan-Meier estimate, so they
+    neither count as completed samples nor get dropped.
+    """
+    def __init__(self, min_value: float = 0.01, max_value: float = 60.0, growth: float = 1.2):
+        self.bounds: List[float] = []
+        bound = min_value
+        while bound < max_value:
+            self.bounds.append(bound)
+            bound *= growth
+        self.bounds.append(bound)
+        self.counts = [0] * (len(self.bounds) + 1)  # the last bucket takes everything above
+        self.censored = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.censored_count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def add_censored(self, value: float) -> None:
+        """An attempt cancelled after value seconds without a first token."""
+        self.censored[bisect.bisect_left(self.bounds, value)] += 1
+        self.censored_count += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.count:
+            return None
+        # censored attempts are at risk up to and including their bucket
+        at_risk = self.count + self.censored_count
+        survival = 1.0
+        for i, (count, censored) in enumerate(zip(self.counts, self.censored)):
+            if count:
+                survival *= 1.0 - count / at_risk
+                if 1.0 - survival >= fraction - 1e-9:
+                    return self.bounds[min(i, len(self.bounds) - 1)]
+            at_risk -= count + censored
+        return self.bounds[-1]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "censored": self.censored_count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class HedgedLLMHandler:
+    """
+    Sends a turn to an ordered list of provider handlers to cut the tail of
+    the time to first token.
+
+    The request goes to the first handler. If it has not produced a token
+    after the hedge deadline, the same request also goes to the next one,
+    and so on down the list. The first handler to produce a token wins,
+    its stream is forwarded and the others are cancelled. A handler that
+    fails or ends without a token hands over to the next one at once.
+
+    The deadline of a handler is the hedge_percentile of its own TTFT
+    histogram once it has min_samples, hedge_deadline before that, kept
+    within min_deadline and hedge_deadline * 4.
+
+    A cancelled attempt can not be aborted while it is still connecting, its
+    thread runs on until the request returns. A handler with such a thread
+    is left out of the next turns until it is done, the turn starts with
+    the next provider instead of waiting for it.
+
+    All handlers share the first handler's Conversation, so the history,
+    the token budget and a compaction memory apply to every provider.
+    """
+    def __init__(
+            self,
+            handlers: List,
+            names: Optional[List[str]] = None,
+            hedge_deadline: float = 1.5,
+            hedge_percentile: float = 0.95,
+            min_deadline: float = 0.3,
+            min_samples: int = 10):
+
+        self.handlers = handlers
+        self.names = names or [handler.__class__.__module__ for handler in handlers]
+        self.hedge_deadline = hedge_deadline
+        self.hedge_percentile = hedge_percentile
+        self.min_deadline = min_deadline
+        self.min_samples = min_samples
+
+        self.conversation = handlers[0].conversation
+        for handler in handlers[1:]:
+            handler.conversation = self.conversation
+
+        self.cancel_event = threading.Event()
+        self.threads: List[Optional[threading.Thread]] = [None] * len(handlers)
+        self.payloads: List[Dict[str, Any]] = [{} for _ in handlers]
+        self.payload: Dict[str, Any] = {}
+        self.trace = True
+        self.histograms = [LatencyHistogram() for _ in handlers]
+
+        self.stats = {
+            "turns": 0,
+            "hedges": 0,
+            "fallbacks": 0,
+            "busy": 0,  # handlers skipped, still in a cancelled request
+            "wins": [0] * len(handlers),
+            "failed": 0,
+        }
+
+    def add_user_text(self, text: str):
+        self.conversation.add_user_message(text)
+
+    def add_assistant_text(self, text: str):
+        self.conversation.add_assistant_message(text)
+
+    def token_usage(self, system_prompt: Optional[str] = None) -> Dict[str, float]:
+        return self.conversation.token_usage(system_prompt)
+
+    def prepare_history(self, system_prompt: str):
+        self.conversation.truncate_history(system_prompt)
+        reuse = self.conversation.measure_prefix_reuse(system_prompt)
+        if self.trace:
+            tracer.set_info(prefix_reuse=round(reuse, 3))
+
+    def deadline(self, index: int) -> float:
+        """Seconds to wait for the first token of handler index before hedging."""
+        histogram = self.histograms[index]
+        if histogram.count < self.min_samples:
+            return self.hedge_deadline
+        deadline = histogram.percentile(self.hedge_percentile)
+        return min(max(deadline, self.min_deadline), self.hedge_deadline * 4)
+
+    def _available(self) -> List[int]:
+        """Handlers not busy with a cancelled request of an earlier turn, in order."""
+        available = [index for index, thread in enumerate(self.threads)
+                     if thread is None or not thread.is_alive()]
+        if not available:
+            # all of them are still stuck, wait for the first one
+            self.threads[0].join()
+            available = [0]
+        self.stats["busy"] += len(self.handlers) - len(available)
+        return available
+
+    def _launch(self, index: int, system_prompt: str, events: queue.Queue, launch_times: Dict[int, float]):
+        # only called for an idle handler, a running stream of an earlier
+        # turn would otherwise close the new response
+        handler = self.handlers[index]
+        handler.cancel_event.clear()
+        launch_times[index] = time.perf_counter()
+        thread = threading.Thread(target=self._run_attempt, args=(index, system_prompt, events), daemon=True)
+        self.threads[index] = thread
+        thread.start()
+
+    def _run_attempt(self, index: int, system_prompt: str, events: queue.Queue):
+        handler = self.handlers[index]
+        tokens = None
+        try:
+            self.payloads[index] = handler.build_payload(system_prompt)
+            tokens = handler.stream_tokens(self.payloads[index])
+            for token in tokens:
+                if handler.cancel_event.is_set():
+                    break
+                events.put((index, token))
+        except Exception as e:
+            if not handler.cancel_event.is_set():
+                logger.error(f"{self.names[index]} failed: {e}")
+        finally:
+            if tokens is not None:
+                tokens.close()
+            handler.close_response()
+            events.put((index, None))
+
+    def generate_response(
+            self,
+            system_prompt: str,
+            on_token: Callable[[str], None] = None) -> str:
+
+        system_prompt = self.conversation.with_memory(system_prompt)
+        self.prepare_history(system_prompt)
+        if self.cancel_event.is_set():
+            return ""  # cancelled before the request went out
+        self.stats["turns"] += 1
+
+        events: queue.Queue = queue.Queue()
+        launch_times: Dict[int, float] = {}
+        ended = set()
+        winner = None
+        order = self._available()
+
+        if self.trace:
+            tracer.mark("request_sent")
+        self._launch(order[0], system_prompt, events, launch_times)
+        hedge_time = launch_times[order[0]] + self.deadline(order[0])
+
+        # wait for the first token, hedging on the way
+        while winner is None and not self.cancel_event.is_set():
+            launched = len(launch_times)
+            timeout = None
+            if launched < len(order):
+                timeout = max(0.0, hedge_time - time.perf_counter())
+            try:
+                index, token = events.get(timeout=timeout)
+            except queue.Empty:
+                if self.cancel_event.is_set():
+                    break
+                self.stats["hedges"] += 1
+                next_index = order[launched]
+                logger.debug(f"No first token from {self.names[order[launched - 1]]}, hedging to {self.names[next_index]}")
+                self._launch(next_index, system_prompt, events, launch_times)
+                hedge_time = launch_times[next_index] + self.deadline(next_index)
+                continue
+            if token is not None:
+                winner = index
+                self.histograms[index].add(time.perf_counter() - launch_times[index])
+                first_token = token
+                break
+            ended.add(index)
+            if self.cancel_event.is_set():
+                break  # the end of a cancelled attempt, not a failure
+            if launched < len(order):
+                self.stats["fallbacks"] += 1
+                next_index = order[launched]
+                self._launch(next_index, system_prompt, events, launch_times)
+                hedge_time = launch_times[next_index] + self.deadline(next_index)
+            elif len(ended) == launched:
+                break
+
+        cancel_time = time.perf_counter()
+        for index in launch_times:
+            if index != winner and index not in ended:
+                self.handlers[index].cancel()
+                if winner is not None:
+                    # its first token would have taken at least this long,
+                    # without it the deadline drifts low
+                    self.histograms[index].add_censored(cancel_time - launch_times[index])
+
+        if winner is None:
+            if not self.cancel_event.is_set():
+                self.stats["failed"] += 1
+                logger.error("No provider produced a response")
+            return ""
+
+        self.stats["wins"][winner] += 1
+        self.payload = self.payloads[winner]
+        if self.trace:
+            tracer.set_info(llm_provider=self.names[winner], hedged=len(launch_times) > 1)
+
+        collected_messages = []
+        token = first_token
+        while token is not None:
+            if self.cancel_event.is_set():
+                break
+            collected_messages.append(token)
+            if self.trace:
+                tracer.mark("first_token")
+            if on_token:
+                on_token(token)
+            index, token = events.get()
+            while index != winner:
+                index, token = events.get()
+
+        return ''.join(collected_messages)
+
+    def begin_turn(self):
+        self.cancel_event.clear()
+
+    def cancel(self):
+        """Abort a running generate_response from another thread."""
+        self.cancel_event.set()
+        for handler in self.handlers:
+            handler.cancel()
+
+    def warm_up(self, system_prompt: str) -> Optional[bool]:
+        results = [handler.warm_up(system_prompt) for handler in self.handlers]
+        if all(result is None for result in results):
+            return None
+        return any(results)
+
+    def latency_summary(self) -> Dict[str, Dict[str, Any]]:
+        return {name: histogram.summary() for name, histogram in zip(self.names, self.histograms)}
+
+    def close(self):
+        for handler in self.handlers:
+            handler.close()
+
+    def write_payload(self, file_path: str = 'payload.txt', mode='w'):
+        with open(file_path, mode) as f:
+            json.dump(self.payload, f, indent=4)
@@ -0,0 +1,302 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from lib.conversation import Conversation
+from lib.llmtransport import HTTPTransport, AsyncHTTPTransport
+from lib.streamreader import DONE
+from lib.tokencounter import get_token_counter
+from lib.turntrace import tracer
+
+
+class BaseLLMHandler:
+    """
+    Common part of the provider LLMHandler classes: completion params,
+    conversation history, the streaming loop with cancellation, tracing and
+    stats, and payload dumps.
+
+    A provider implements build_payload() and stream_tokens(), which sends
+    the request and yields the text tokens of the reply.
+
+    The history is kept within a token budget before every request. The
+    tokenizer comes from "tokenizer" in completion_params.json (see
+    lib/tokencounter.py) or the provider's default_tokenizer, the budget
+    from "context_budget" or max_tokens. "evict_to" sets how far below the
+    budget a truncation goes, see Conversation.
+    """
+    default_tokenizer = "estimate"
+    # completion_params.json keys that configure the handler, not the request
+    handler_params = ("tokenizer", "context_budget", "evict_to")
+
+    def __init__(
+            self,
+            completion_params_file: str,
+            max_tokens: int = 1000,
+            log_stats: bool = False):
+
+        self.completion_params = self.load_completion_params(completion_params_file)
+        self.max_tokens = max_tokens
+        self.count_tokens = get_token_counter(self.completion_params.get("tokenizer", self.default_tokenizer))
+        self.conversation = Conversation(
+            self.completion_params.get("context_budget", max_tokens),
+            count_tokens_func=self.count_tokens,
+            evict_to=self.completion_params.get("evict_to", 0.6))
+        self.log_stats = log_stats
+        self.cancel_event = threading.Event()
+        self.active_response = None
+        self.payload: Dict[str, Any] = {}
+        self.trace = True  # report request and first token to the turn trace
+        self.logger = logging.getLogger(self.__class__.__module__)
+
+    def load_completion_params(self, file_path: str) -> Dict[str, Any]:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+
+    def add_user_text(self, text: str):
+        self.conversation.add_user_message(text)
+
+    def add_assistant_text(self, text: str):
+        self.conversation.add_assistant_message(text)
+
+    def payload_params(self) -> Dict[str, Any]:
+        """completion_params without the handler settings."""
+        return {key: value for key, value in self.completion_params.items() if key not in self.handler_params}
+
+    def prepare_history(self, system_prompt: str):
+        """Fit the history into the budget and record how much of the prompt prefix is reused."""
+        self.conversation.truncate_history(system_prompt)
+        reuse = self.conversation.measure_prefix_reuse(system_prompt)
+        if self.trace:
+            tracer.set_info(prefix_reuse=round(reuse, 3))
+        if self.log_stats:
+            print(f"Prompt prefix reuse: {reuse * 100:.1f}%")
+
+    def token_usage(self, system_prompt: Optional[str] = None) -> Dict[str, float]:
+        return self.conversation.token_usage(system_prompt)
+
+    def create_messages(self, system_prompt: str) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": system_prompt}]
+        for role, message in self.conversation.get_history():
+            messages.append({"role": role, "content": message})
+        return messages
+
+    def build_payload(self, system_prompt: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def stream_tokens(self, payload: Dict[str, Any]) -> Iterator[str]:
+        """Send the request and yield the reply tokens. Set self.active_response so cancel() can close it."""
+        raise NotImplementedError
+
+    def build_warmup_payload(self, system_prompt: str) -> Optional[Dict[str, Any]]:
+        """Request that loads the model and prefills the prompt without generating, None if the provider needs none."""
+        return None
+
+    def send_warmup(self, payload: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def warm_up(self, system_prompt: str) -> Optional[bool]:
+        """
+        Prefill the prompt the next turn starts with (system prompt, memory
+        and history) so its time to first token only covers the new user
+        message. Leaves the payload and prefix stats of the turns alone.
+        Returns None if the provider has nothing to warm up.
+        """
+        system_prompt = self.conversation.with_memory(system_prompt)
+        with self.conversation.lock:
+            self.conversation.truncate_history(system_prompt)
+            payload = self.build_warmup_payload(system_prompt)
+        if payload is None:
+            return None
+        return self.send_warmup(payload)
+
+    def begin_turn(self):
+        """
+        Arm cancel() for the next request. Called before anything can cancel
+        it, so a cancel() that lands before the request is sent still counts.
+        """
+        self.cancel_event.clear()
+
+    def generate_response(
+            self,
+            system_prompt: str,
+            on_token: Callable[[str], None] = None) -> str:
+
+        system_prompt = self.conversation.with_memory(system_prompt)
+        self.prepare_history(system_prompt)
+        self.payload = self.build_payload(system_prompt)
+
+        if self.cancel_event.is_set():
+            return ""  # cancelled before the request went out
+
+        start_time = time.time()
+        collected_messages = []
+
+        if self.trace:
+            tracer.mark("request_sent")
+        tokens = self.stream_tokens(self.payload)
+        try:
+            for token in tokens:
+                if self.cancel_event.is_set():
+                    break
+                collected_messages.append(token)
+                if self.trace:
+                    tracer.mark("first_token")
+                if on_token:
+                    on_token(token)
+
+                if self.log_stats:
+                    chunk_time = time.time() - start_time
+                    print(f"Token received {chunk_time:.2f} seconds after request: {token}")
+
+            if self.log_stats:
+                total_time = time.time() - start_time
+                print(f"Full response received {total_time:.2f} seconds after request")
+                print(f"Full response: {''.join(collected_messages)}")
+
+        except Exception as e:
+            # closing the response from cancel() aborts the blocking read
+            if not self.cancel_event.is_set():
+                self.logger.error(f"An error occurred: {e}")
+        finally:
+            tokens.close()
+            self.close_response()
+
+        return ''.join(collected_messages)
+
+    def close_response(self):
+        response, self.active_response = self.active_response, None
+        if response is not None:
+            response.close()
+
+    def cancel(self):
+        """Abort a running generate_response from another thread."""
+        self.cancel_event.set()
+        response = self.active_response
+        if response is not None:
+            response.close()
+
+    def create_background_handler(self) -> "BaseLLMHandler":
+        """
+        A handler of the same provider for requests beside the turns
+        (compaction summaries), with its own history, stream and cancel state.
+        """
+        return self.__class__()
+
+    def close(self):
+        """Release pooled connections."""
+        pass
+
+    def write_payload(self, file_path: str = 'payload.txt', mode='w'):
+        with open(file_path, mode) as f:
+            json.dump(self.payload, f, indent=4)
+
+
+class HTTPLLMHandler(BaseLLMHandler):
+    """
+    Base for providers streaming over plain HTTP, either as server-sent
+    events ("data: {...}" lines) or as newline delimited JSON. Requests go
+    through a pooled keep-alive HTTPTransport. A provider only maps one
+    decoded event to its text in parse_event().
+    """
+    stream_format = "sse"  # or "ndjson"
+
+    def __init__(
+            self,
+            url: str,
+            completion_params_file: str,
+            max_tokens: int = 1000,
+            log_stats: bool = False,
+            connect_timeout: float = 3.0,
+            read_timeout: float = 60.0):
+
+        super().__init__(completion_params_file, max_tokens, log_stats)
+        self.url = url
+        self.transport = HTTPTransport(connect_timeout, read_timeout)
+        self.async_transport: Optional[AsyncHTTPTransport] = None
+
+    def parse_event(self, event: Dict[str, Any]) -> Optional[str]:
+        """Return the text of one stream event, None at the end of the stream."""
+        raise NotImplementedError
+
+    def stream_tokens(self, payload: Dict[str, Any]) -> Iterator[str]:
+        response = self.transport.post_stream(self.url, payload)
+        self.active_response = response
+        if self.cancel_event.is_set():
+            return
+        if response.status_code != 200:
+            self.logger.error(f"Error: {response.status_code}")
+            self.logger.error(response.text)
+            return
+        finished = False
+        for event in self.transport.iter_events(response, self.stream_format):
+            # after the end event keep reading to the end of the body, only
+            # a fully consumed response returns its connection to the pool
+            if finished:
+                continue
+            token = None if event is DONE else self.parse_event(event)
+            if token is None:
+                finished = True
+            elif token:
+                yield token
+
+    async def agenerate_response(
+            self,
+            system_prompt: str,
+            on_token: Callable[[str], None] = None) -> str:
+        """asyncio variant of generate_response on a pooled aiohttp session."""
+        if self.async_transport is None:
+            self.async_transport = AsyncHTTPTransport(*self.transport.timeout)
+        system_prompt = self.conversation.with_memory(system_prompt)
+        self.prepare_history(system_prompt)
+        self.payload = self.build_payload(system_prompt)
+
+        collected_messages = []
+
+        if self.trace:
+            tracer.mark("request_sent")
+        try:
+            async for event in self.async_transport.stream_events(
+                    self.url, self.payload, self.stream_format, self.cancel_event):
+                token = None if event is DONE else self.parse_event(event)
+                if token is None:
+                    break
+                if token:
+                    collected_messages.append(token)
+                    if self.trace:
+                        tracer.mark("first_token")
+                    if on_token:
+                        on_token(token)
+        except Exception as e:
+            if not self.cancel_event.is_set():
+                self.logger.error(f"An error occurred: {e}")
+
+        return ''.join(collected_messages)
+
+    def cancel(self):
+        self.cancel_event.set()
+        response = self.active_response
+        if response is not None:
+            self.transport.abort(response)
+
+    def send_warmup(self, payload: Dict[str, Any]) -> bool:
+        try:
+            response = self.transport.post_stream(self.url, payload)
+            with response:
+                # read the whole body, the connection then goes back to the pool
+                body = response.content
+                if response.status_code != 200:
+                    self.logger.warning(f"Warm-up failed: {response.status_code} {body[:200]!r}")
+                    return False
+            return True
+        except Exception as e:
+            self.logger.warning(f"Warm-up failed: {e}")
+            return False
+
+    def close(self):
+        self.transport.close()
+
+    async def aclose(self):
+        self.transport.close()
+        if self.async_transport is not None:
+            await self.async_transport.close()
@@ -0,0 +1,121 @@
+import json
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from lib.streamreader import StreamEventReader, iter_response_events
+
+DEFAULT_HEADERS = {"Content-Type": "application/json"}
+
+
+class HTTPTransport:
+    """
+    Pooled keep-alive HTTP session for the streaming LLM endpoints.
+
+    The first request opens the TCP connection, every later turn reuses it,
+    so connection setup is paid once instead of on every time-to-first-token.
+    Requests use a short connect timeout and a read timeout that bounds the
+    gap between two streamed chunks, not the whole generation.
+    """
+    def __init__(
+            self,
+            connect_timeout: float = 3.0,
+            read_timeout: float = 60.0,
+            pool_size: int = 4,
+            headers: Optional[Dict[str, str]] = None):
+
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.lock = threading.Lock()
+        self.session: Optional[requests.Session] = None
+        self.pool_size = pool_size
+
+    def get_session(self) -> requests.Session:
+        with self.lock:
+            if self.session is None:
+                session = requests.Session()
+                # no automatic retries, a retried stream would replay tokens
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(self.headers)
+                self.session = session
+            return self.session
+
+    def post_stream(self, url: str, payload: Dict[str, Any]) -> requests.Response:
+        """POST payload as JSON and return the response with an unread body."""
+        return self.get_session().post(url, data=json.dumps(payload), stream=True, timeout=self.timeout)
+
+    def abort(self, response: requests.Response) -> None:
+        """
+        Close a streaming response from another thread. close() alone waits
+        until a read blocked in the streaming thread returns, shutting the
+        socket down first makes that read return at once.
+        """
+        shutdown = getattr(response.raw, "shutdown", None)  # urllib3 >= 2.3
+        if shutdown is not None:
+            shutdown()
+        response.close()
+
+    def iter_events(self, response: requests.Response, format: str = "sse") -> Iterator[Any]:
+        """Yield decoded stream events as soon as each one is complete."""
+        return iter_response_events(response, format)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+
+class AsyncHTTPTransport:
+    """
+    asyncio variant of HTTPTransport on a pooled aiohttp ClientSession.
+    Needs aiohttp, which is only imported when the transport is first used.
+    """
+    def __init__(
+            self,
+            connect_timeout: float = 3.0,
+            read_timeout: float = 60.0,
+            pool_size: int = 4,
+            headers: Optional[Dict[str, str]] = None):
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.session = None
+
+    async def get_session(self):
+        if self.session is None or self.session.closed:
+            import aiohttp
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout))
+        return self.session
+
+    async def stream_events(
+            self,
+            url: str,
+            payload: Dict[str, Any],
+            format: str = "sse",
+            cancel_event: threading.Event = None) -> AsyncIterator[Any]:
+        """POST payload and yield the decoded stream events."""
+        session = await self.get_session()
+        reader = StreamEventReader(format)
+        async with session.post(url, data=json.dumps(payload)) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}: {await response.text()}")
+            async for data in response.content.iter_any():
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                for event in reader.feed(data):
+                    yield event
+            for event in reader.flush():
+                yield event
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,153 @@
+import re
+from typing import List, Tuple
+
+# (text, final): final units end a sentence, the others end at a clause
+Unit = Tuple[str, bool]
+
+# a sentence terminator or clause delimiter, closing quotes or brackets, then whitespace
+_SENTENCE_END = re.compile(r'[.!?…。]+["\'”’)\]]*(?=\s)')
+_CLAUSE_END = re.compile(r'[,;:]["\'”’)\]]*(?=\s)')
+# a run of delimiters and closing quotes or brackets followed by any other
+# character, for the first unit
+_FIRST_UNIT_END = re.compile(r'([.!?…。,;:]+)["\'”’)\]]*(?=[^.!?…。,;:"\'”’)\]])')
+# may stand inside a word or number ("e.g.", "3.5", "1,000", "10:30")
+_IN_WORD = {".", ",", ":"}
+# what can continue a terminator run after the first unit was cut
+_RUN_CHARS = '.!?…。,;:"\'”’)]'
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "vs", "e.g", "i.e", "etc"}
+
+
+class SentenceSegmenter:
+    """
+    Incremental sentence / clause segmenter for the LLM text stream.
+
+    Runs once on the parsed text (after EmotionTextStream) and cuts it
+    into units that are ready to synthesize, so the TTS engine does not
+    split again and never waits for look-ahead context: a boundary is
+    recognized as soon as the whitespace after a delimiter arrives.
+
+    - A sentence ends at a terminator; shorter than min_chars it is kept
+      and joined with the next one. These units are final.
+    - The first unit of a turn is cut at the first delimiter after
+      first_fragment_chars, to get the first audio out early. At "?",
+      "!", "…", "。" and at a "." or "," after a word it is cut as soon as
+      the delimiter arrives; the rest of the terminator run (the "!" of
+      "?!", closing quotes) is dropped instead of starting the next unit.
+      A "." or "," that can stand inside an abbreviation or number, and
+      ":", are cut once whitespace follows.
+    - Sentences longer than max_chars are cut at clause delimiters.
+    - flush() emits the rest as a final unit, call it at every emotion tag
+      and at the end of the turn.
+    """
+    def __init__(
+            self,
+            min_chars: int = 10,
+            first_fragment_chars: int = 10,
+            max_chars: int = 150):
+
+        self.min_chars = min_chars
+        self.first_fragment_chars = first_fragment_chars
+        self.max_chars = max_chars
+        self.reset()
+
+    def reset(self) -> None:
+        """Start a new turn, the next unit is a first fragment again."""
+        self.buffer = ""
+        self.scan_pos = 0
+        self.first_unit = True
+        self.skip_run = False
+
+    def feed(self, text: str) -> List[Unit]:
+        """Add text and return the units it completes."""
+        self.buffer += text
+        if self.skip_run:
+            # the first unit was cut inside a terminator run, drop its rest
+            rest = self.buffer.lstrip(_RUN_CHARS)
+            self.skip_run = not rest
+            self.buffer = rest
+        units: List[Unit] = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            end, final = cut
+            self._emit(self.buffer[:end], final, units)
+            self.buffer = self.buffer[end:]
+            self.scan_pos = 0
+        return units
+
+    def flush(self) -> List[Unit]:
+        """Emit the buffered text as a final unit (emotion boundary or end of turn)."""
+        units: List[Unit] = []
+        self._emit(self.buffer, True, units)
+        self.buffer = ""
+        self.scan_pos = 0
+        self.skip_run = False
+        return units
+
+    def _emit(self, text: str, final: bool, units: List[Unit]) -> None:
+        text = text.strip()
+        if text:
+            units.append((text, final))
+            self.first_unit = False
+
+    def _find_cut(self):
+        buffer = self.buffer
+        cuts = []
+        for match in _SENTENCE_END.finditer(buffer, self.scan_pos):
+            end = match.end()
+            if match.group()[0] == '.' and self._is_abbreviation(match.start()):
+                continue
+            if len(buffer[:end].strip()) >= self.min_chars:
+                cuts.append((end, True))
+                break
+
+        if self.first_unit:
+            for match in _FIRST_UNIT_END.finditer(buffer, self.scan_pos):
+                end = match.end()
+                delimiters = match.group(1)
+                if delimiters in _IN_WORD and not buffer[end].isspace():
+                    continue
+                if delimiters[0] == '.' and self._is_abbreviation(match.start()):
+                    continue
+                if len(buffer[:end].strip()) >= self.first_fragment_chars:
+                    cuts.append((end, delimiters[-1] not in ",;:"))
+                    break
+
+        clause_min = self.first_fragment_chars if self.first_unit else self.max_chars
+        if len(buffer.strip()) >= clause_min:
+            for match in _CLAUSE_END.finditer(buffer, self.scan_pos):
+                end = match.end()
+                if len(buffer[:end].strip()) >= clause_min:
+                    cuts.append((end, False))
+                    break
+        if cuts:
+            return min(cuts)
+
+        if self.first_unit and len(buffer.strip()) >= self.first_fragment_chars:
+            final = self._eager_end(buffer)
+            if final is not None:
+                self.skip_run = True
+                return len(buffer), final
+
+        # nothing to cut, next time only look at the new text
+        self.scan_pos = max(0, len(buffer) - 8)
+        return None
+
+    def _eager_end(self, buffer: str):
+        """Whether the delimiter at the end of the buffer ends a sentence, None if it has to wait."""
+        last = buffer[-1]
+        if last in "?!…。":
+            return True
+        if last not in ".," or len(buffer) < 2 or not buffer[-2].isalpha():
+            return None
+        if last == '.':
+            word = buffer.split()[-1][:-1]
+            if len(word) < 2 or '.' in word or word.lower() in _ABBREVIATIONS:
+                return None
+            return True
+        return False
+
+    def _is_abbreviation(self, position: int) -> bool:
+        words = self.buffer[:position].split()
+        return bool(words) and words[-1].lower() in _ABBREVIATIONS
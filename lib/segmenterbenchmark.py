@@ -0,0 +1,199 @@
+import random
+import re
+from stream2sentence import generate_sentences
+from segmenter import SentenceSegmenter
+from textstream import EmotionTextStream
+
+# First-fragment latency of the text pipeline, on simulated LLM streams in
+# virtual time (no sleeps, every token has an arrival time):
+#
+#   before  Main splits at emotion tags only, each running sentence goes
+#           through the coalescing BufferStream to RealtimeTTS, which
+#           re-splits it with stream2sentence, using the settings of
+#           TTSHandler.start_tts
+#   after   SentenceSegmenter runs once on the parsed text
+#
+#   first fragment  first token to the first unit ready for synthesis
+#   hold            arrival of a unit's last character to the unit being
+#                   ready, the time spent waiting for look-ahead context
+#
+#   python segmenterbenchmark.py
+
+REPLIES = [
+    "[happy] Oh, hello there! It's so nice to see you again, I was hoping you'd stop by. "
+    "[curious] So tell me, what have you been up to lately? "
+    "[excited] I just finished reading the most amazing book, you would love it. "
+    "[calm] But first, let's get you something warm to drink.",
+    "[sarcastic] Well, that went about as well as expected. "
+    "[thoughtful] Maybe next time we try the plan that doesn't involve the goat. "
+    "[amused] Although, I have to admit, the goat was a nice touch. "
+    "[cheerful] Anyway, dinner is on me tonight!",
+    "[calm] Sure. "
+    "[helpful] Take the second left after the bridge, then follow the river for about ten minutes. "
+    "[friendly] You can't miss it, there's a big red door. "
+    "[happy] Have a great trip!",
+    "[sad] I'm sorry to hear that. "
+    "[caring] Losing a pet is never easy, and it's okay to take some time. "
+    "[hopeful] If you want to talk about them, I'm here. "
+    "[calm] Whenever you're ready.",
+]
+
+
+COALESCE_WINDOW = 0.02  # TTSHandler's coalesce_window
+
+
+def sentence_tokenizer(text):
+    # stands in for the nltk punkt tokenizer so the benchmark runs offline,
+    # it finds the same boundaries in these replies
+    return re.split(r'(?<=[.!?…])\s+', text)
+
+
+def make_stream(reply, rng):
+    """Tokens of 1-6 characters with arrival times of a ~40 tokens/s model."""
+    tokens = []
+    now = 0.0
+    pos = 0
+    while pos < len(reply):
+        size = rng.randint(1, 6)
+        now += rng.uniform(0.01, 0.04)
+        tokens.append((now, reply[pos:pos + size]))
+        pos += size
+    return tokens
+
+
+def parse(tokens):
+    """(time, text, emotion) events of the parsed stream."""
+    stream = EmotionTextStream()
+    events = []
+    for at, token in tokens:
+        events.extend((at, text, emotion) for text, emotion in stream.feed(token))
+    events.extend((tokens[-1][0], text, emotion) for text, emotion in stream.flush())
+    return events
+
+
+def arrival_times(text_events):
+    """Arrival time of every character of the concatenated text events."""
+    times = []
+    for at, text, _ in text_events:
+        times.extend([at] * len(text))
+    return times
+
+
+def coalesce(text_events, end_time, window=COALESCE_WINDOW):
+    """
+    (time, text) as the BufferStream of a running sentence hands it on: text
+    ending inside a word waits up to window for the rest of the word.
+    """
+    chunks = []
+    i = 0
+    while i < len(text_events):
+        at, text, _ = text_events[i]
+        i += 1
+        deadline = at + window
+        while text[-1].isalnum() and i < len(text_events) and text_events[i][0] <= deadline:
+            at = text_events[i][0]
+            text += text_events[i][1]
+            i += 1
+        if text[-1].isalnum():
+            at = min(deadline, end_time)
+        chunks.append((at, text))
+    return chunks
+
+
+def units_before(events):
+    """(ready time, unit, arrival of its text) through the former two splitters."""
+    segments = []  # [text events, end time] per emotion sentence
+    for at, text, emotion in events:
+        if emotion is not None:
+            if segments:
+                segments[-1][1] = at
+            segments.append([[], None])
+        elif segments:
+            segments[-1][0].append((at, text, None))
+    segments[-1][1] = events[-1][0]
+
+    ready = []
+    for text_events, end_time in segments:
+        clock = [0.0]
+
+        def feed():
+            for at, text in coalesce(text_events, end_time):
+                clock[0] = at
+                yield text
+            clock[0] = end_time  # the BufferStream stops at the next tag
+
+        ready.extend(locate(text_events, (
+            (clock[0], fragment) for fragment in generate_sentences(
+                feed(),
+                context_size=5,
+                minimum_sentence_length=10,
+                minimum_first_fragment_length=10,
+                quick_yield_single_sentence_fragment=True,
+                sentence_fragment_delimiters=".?!;:,\n…)]}。",
+                force_first_fragment_after_words=999999,
+                tokenize_sentences=sentence_tokenizer) if fragment.strip())))
+    return ready
+
+
+def units_after(events):
+    segmenter = SentenceSegmenter()
+    ready = []
+    text_events = []
+    units = []
+    for at, text, emotion in events:
+        if emotion is not None:
+            units.extend((at, unit) for unit, _ in segmenter.flush())
+            ready.extend(locate(text_events, units))
+            text_events, units = [], []
+        else:
+            text_events.append((at, text, None))
+            units.extend((at, unit) for unit, _ in segmenter.feed(text))
+    units.extend((events[-1][0], unit) for unit, _ in segmenter.flush())
+    ready.extend(locate(text_events, units))
+    return ready
+
+
+def locate(text_events, units):
+    """Add the arrival time of each unit's last character."""
+    text = ''.join(text for _, text, _ in text_events)
+    times = arrival_times(text_events)
+    cursor = 0
+    located = []
+    for at, unit in units:
+        position = text.find(unit.strip(), cursor)
+        assert position >= 0, f"{unit!r} not in {text!r}"
+        cursor = position + len(unit.strip())
+        located.append((at, unit, times[cursor - 1]))
+    return located
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_benchmark(runs: int = 200, seed: int = 42):
+    rng = random.Random(seed)
+    results = {"before": ([], []), "after": ([], [])}
+    for i in range(runs):
+        tokens = make_stream(REPLIES[i % len(REPLIES)], rng)
+        events = parse(tokens)
+        start = tokens[0][0]
+        for name, split in (("before", units_before), ("after", units_after)):
+            ready = split(events)
+            first, holds = results[name]
+            first.append((ready[0][0] - start) * 1000)
+            holds.extend((at - arrived) * 1000 for at, _, arrived in ready)
+
+    example = parse(make_stream(REPLIES[0], random.Random(seed)))
+    for name, split in (("before", units_before), ("after", units_after)):
+        print(f"{name}: {[unit for _, unit, _ in split(example)]}")
+
+    print(f"\n{'':8s} {'first fragment p50':>19s} {'p95':>8s} {'hold p50':>10s} {'p95':>8s} {'max':>8s}")
+    for name, (first, holds) in results.items():
+        print(f"{name:8s} {percentile(first, 0.5):16.1f} ms {percentile(first, 0.95):5.1f} ms"
+              f" {percentile(holds, 0.5):7.1f} ms {percentile(holds, 0.95):5.1f} ms {max(holds):5.1f} ms")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -1,88 +1,270 @@
+import itertools
 import threading
-from typing import Optional
-import uuid
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+_sentence_ids = itertools.count(1)
 
 class Sentence:
-    def __init__(self, emotion: Optional[str] = None):
-        self.text = ""
+    """
+    Text of one sentence as an append-only log of fragments. The writer
+    appends, readers follow with read_since() from their own offset and
+    only ever receive what is new, without copying the whole text.
+    """
+    __slots__ = ("fragments", "length", "emotion", "is_finished", "retrieved", "popped",
+                 "condition", "id", "generation", "final", "_text", "_text_count")
+
+    def __init__(self, emotion: Optional[str] = None, generation: int = 0, final: bool = True):
+        self.fragments: List[str] = []
+        self.length = 0  # characters
         self.emotion = emotion
         self.is_finished = False
         self.retrieved = False
         self.popped = False
-        self.lock = threading.Lock()
-        self.id: str = str(uuid.uuid4())
+        self.condition = threading.Condition(threading.Lock())
+        self.id: int = next(_sentence_ids)
+        self.generation = generation
+        self.final = final  # False for a clause cut off before the sentence end
+        self._text = ""  # joined text of the first _text_count fragments
+        self._text_count = 0
 
     def add_text(self, text: str):
-        with self.lock:
-            self.text += text
+        with self.condition:
+            self.fragments.append(text)
+            self.length += len(text)
+            self.condition.notify_all()
+
+    def read_since(self, offset: int, timeout: Optional[float] = None) -> Tuple[List[str], int, bool]:
+        """
+        Wait until there are fragments after offset or the sentence is
+        finished, at most timeout seconds. Returns the new fragments, the
+        offset to continue from and whether everything has been read.
+        """
+        with self.condition:
+            if offset >= len(self.fragments) and not self.is_finished:
+                self.condition.wait_for(lambda: offset < len(self.fragments) or self.is_finished, timeout)
+            fragments = self.fragments[offset:]
+            return fragments, len(self.fragments), self.is_finished
+
+    @property
+    def text(self) -> str:
+        return self.get_text()
 
     def get_text(self):
-        with self.lock:
-            return self.text
+        with self.condition:
+            if self._text_count < len(self.fragments):
+                self._text += ''.join(self.fragments[self._text_count:])
+                self._text_count = len(self.fragments)
+            return self._text
 
     def mark_finished(self):
-        with self.lock:
+        with self.condition:
             self.is_finished = True
+            self.condition.notify_all()
 
     def get_finished(self):
-        with self.lock:
+        with self.condition:
             return self.is_finished
 
     def __str__(self):
-        with self.lock:
-            return f"Sentence(text='{self.text}', emotion='{self.emotion}', is_finished={self.is_finished})"
+        return f"Sentence(text='{self.get_text()}', emotion='{self.emotion}', is_finished={self.get_finished()})"
+
+
+def spoken_text(segments: List[Tuple[int, Sentence]], consumed: int, written: int) -> str:
+    """
+    Text of a turn that was actually heard, with emotion tags. segments are
+    (playout byte position, sentence) at the start of each sentence's audio,
+    consumed and written the playout positions at the interrupt.
+    """
+    parts = []
+    emotion = None
+    for i, (start, sentence) in enumerate(segments):
+        if start >= consumed:
+            break
+        end = segments[i + 1][0] if i + 1 < len(segments) else written
+        text = sentence.get_text().strip()
+        if consumed < end and end > start:
+            # cut off inside this sentence, estimate the spoken words
+            # from the share of its audio that was played
+            words = text.split()
+            text = ' '.join(words[:int(len(words) * (consumed - start) / (end - start))])
+        if text:
+            # segmented units of one emotion share its tag
+            tagged = sentence.emotion and sentence.emotion != emotion
+            parts.append(f"[{sentence.emotion}] {text}" if tagged else text)
+            emotion = sentence.emotion
+    return ' '.join(parts)
+
 
 class ThreadSafeSentenceQueue:
-    def __init__(self):
-        self.queue = []
-        self.current_sentence = None
+    """
+    Sentences of the current turn, from the LLM thread to the TTS worker.
+
+    Finished sentences wait in a deque. When none is waiting, the sentence
+    still being written is handed out once (retrieved), so synthesis can
+    start before it is complete. get_sentence() blocks on a condition
+    variable, every add that makes a sentence available wakes it.
+
+    finish_turn() ends the text of a turn. Once its last sentence has been
+    handed out, get_sentence() returns None one time, which tells the
+    consumer that the turn is drained. clear(generation) drops a stale
+    turn, sentences carry the generation they were created in.
+
+    With a segmenter (lib/segmenter.py) the text is cut into finished
+    units as it arrives instead: every unit is queued as its own finished
+    Sentence, emotion tags and the end of the turn flush the segmenter,
+    and there is no running sentence.
+    """
+    def __init__(self, segmenter=None):
+        self.queue: Deque[Sentence] = deque()
+        self.current_sentence: Optional[Sentence] = None
+        self.segmenter = segmenter
+        self.emotion: Optional[str] = None  # of the units the segmenter emits
+        self.generation = 0
+        self.turn_finished = False  # all text of the turn is in
+        self.end_pending = False    # the drained signal is not delivered yet
+        self.drained_generation = -1
+        self.closed = False
         self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+    def _queue_units(self, units) -> None:
+        # caller holds the lock
+        for text, final in units:
+            sentence = Sentence(self.emotion, self.generation, final)
+            sentence.fragments.append(text)
+            sentence.length = len(text)
+            sentence.is_finished = True
+            self.queue.append(sentence)
+        if units:
+            self.condition.notify_all()
+
+    def _finish_current(self):
+        # caller holds the lock
+        if self.segmenter is not None:
+            self._queue_units(self.segmenter.flush())
+            return
+        sentence = self.current_sentence
+        if sentence and not sentence.is_finished:
+            sentence.mark_finished()
+            if not sentence.retrieved:
+                self.queue.append(sentence)
+                self.condition.notify_all()
+        self.current_sentence = None
 
     def finish_current_sentence(self):
         with self.lock:
-            if self.current_sentence and not self.current_sentence.is_finished:
-                self.current_sentence.mark_finished()
-                if not self.current_sentence.retrieved:
-                    self.queue.append(self.current_sentence)
-                self.current_sentence = None
+            self._finish_current()
+
+    def finish_turn(self):
+        """Finish the last sentence and mark the end of the turn's text."""
+        with self.lock:
+            self._finish_current()
+            self.turn_finished = True
+            self.end_pending = True
+            self.condition.notify_all()
 
     def add_emotion(self, emotion: str):
         with self.lock:
-            if self.current_sentence and self.current_sentence.get_text():
-                self.current_sentence.mark_finished()
-                if not self.current_sentence.retrieved:
-                    self.queue.append(self.current_sentence)
-            self.current_sentence = Sentence(emotion)
+            if self.segmenter is not None:
+                self._finish_current()
+                self.emotion = emotion
+                return
+            if self.current_sentence and self.current_sentence.length:
+                self._finish_current()
+            self.current_sentence = Sentence(emotion, self.generation)
+            self.condition.notify_all()
 
-    def add_text(self, text: str):
+    def add_text(self, text: str) -> bool:
+        """Add text of the turn, returns True when it made a sentence available."""
         with self.lock:
-            # print(f"Text: {text}, not text.strip(): {not text.strip()}, not self.current_sentence: {not self.current_sentence}")
-            # if self.current_sentence:
-            #     print(f"not self.current_sentence.get_text(): {not self.current_sentence.get_text()}")
+            if self.segmenter is not None:
+                units = self.segmenter.feed(text)
+                self._queue_units(units)
+                return bool(units)
 
             if not text.strip():
                 if not self.current_sentence:
-                    return
-                if not self.current_sentence.get_text():
-                    return
+                    return False
+                if not self.current_sentence.length:
+                    return False
 
             if not self.current_sentence:
-                self.current_sentence = Sentence()
-            
-            #print(f"added {text} to sentence {self.current_sentence.id}")
+                self.current_sentence = Sentence(generation=self.generation)
+                self.condition.notify_all()
+
             self.current_sentence.add_text(text)
+            return True
+
+    def _take(self) -> Optional[Sentence]:
+        # caller holds the lock
+        if self.queue:
+            sentence = self.queue.popleft()
+            sentence.popped = True
+            return sentence
+        sentence = self.current_sentence
+        if sentence is not None and not sentence.retrieved:
+            sentence.retrieved = True
+            return sentence
+        return None
+
+    def _drained(self) -> bool:
+        return (self.turn_finished and not self.queue
+                and (self.current_sentence is None or self.current_sentence.retrieved))
+
+    def get_sentence(self, timeout: Optional[float] = None) -> Optional[Sentence]:
+        """
+        Return the next sentence, waiting up to timeout seconds for one
+        (forever with None). Returns None on timeout, after close() and
+        once when the finished turn is drained (see drained_generation).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while True:
+                sentence = self._take()
+                if sentence is not None:
+                    if self._drained():
+                        self.condition.notify_all()  # for wait_until_drained
+                    return sentence
+                if self.end_pending and self._drained():
+                    self.end_pending = False
+                    self.drained_generation = self.generation
+                    return None
+                if self.closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def wait_until_drained(self, timeout: Optional[float] = None) -> bool:
+        """Block until the turn is finished and all its sentences were handed out."""
+        with self.lock:
+            return self.condition.wait_for(lambda: self._drained() or self.closed, timeout)
+
+    def clear(self, generation: Optional[int] = None):
+        """Drop all sentences, with a generation the following ones belong to that turn."""
+        with self.lock:
+            self.queue.clear()
+            if self.current_sentence is not None:
+                # a reader streaming the dropped sentence returns
+                self.current_sentence.mark_finished()
+            self.current_sentence = None
+            if self.segmenter is not None:
+                self.segmenter.reset()
+                self.emotion = None
+            self.turn_finished = False
+            self.end_pending = False
+            if generation is not None:
+                self.generation = generation
+            self.condition.notify_all()
 
-    def get_sentence(self) -> Optional[Sentence]:
+    def close(self):
+        """Release all waiters for good."""
         with self.lock:
-            if self.queue:
-                sentence = self.queue.pop(0)
-                sentence.popped = True
-                return sentence
-            elif self.current_sentence:
-                self.current_sentence.retrieved = True
-                return self.current_sentence
-            else:
-                return None
+            self.closed = True
+            self.condition.notify_all()
 
     def is_empty(self) -> bool:
         with self.lock:
@@ -90,4 +272,4 @@ class ThreadSafeSentenceQueue:
 
     def __len__(self):
         with self.lock:
-            return len(self.queue)
\ No newline at end of file
+            return len(self.queue)
@@ -1,153 +1,220 @@
+import random
 import threading
 import time
-from typing import Optional
-from sentencequeue import ThreadSafeSentenceQueue, Sentence
-
-
-# Include the updated ThreadSafeSentenceQueue and Sentence classes here
-
-def test_sentence_queue():
+from segmenter import SentenceSegmenter
+from sentencequeue import Sentence, ThreadSafeSentenceQueue
+
+# Checks the queue semantics, then compares the blocking consumer with the
+# former one that polled get_sentence() every 10 ms:
+#
+#   wake-up latency  time from a new sentence in the producer to
+#                    get_sentence() returning it in the consumer
+#   throughput       finished sentences per second through the queue
+#   fragment delay   time from Sentence.add_text() to the TTS side having
+#                    the new text, read_since() against get_text() polling
+#
+#   python sentencequeuetester.py
+
+
+def check_queue():
     queue = ThreadSafeSentenceQueue()
 
-    # Test 1: Basic functionality and live updates
     queue.add_emotion("happy")
     queue.add_text("Hello, ")
-    #sentence = queue.get_sentence()
-    #assert sentence is None, f"Test 1a failed. Got: {sentence}"
     queue.add_text("world!")
     queue.finish_current_sentence()
-    sentence = queue.get_sentence()
-    assert str(sentence) == "Sentence(text='Hello, world!', emotion='happy', is_finished=True)", f"Test 1b failed. Got: {sentence}"
-    print("Test 1 passed: Basic functionality and live updates")
+    sentence = queue.get_sentence(timeout=0)
+    assert str(sentence) == "Sentence(text='Hello, world!', emotion='happy', is_finished=True)", f"Got: {sentence}"
 
-    # Test 2: Multiple sentences with emotion changes
+    # an emotion finishes the running sentence
     queue.add_emotion("sad")
     queue.add_text("Goodbye, ")
-    queue.add_emotion("angry")  # This should finish the previous sentence and start a new one
+    queue.add_emotion("angry")
     queue.add_text("cruel ")
     queue.add_text("world!")
     queue.finish_current_sentence()
+    sentence1 = queue.get_sentence(timeout=0)
+    sentence2 = queue.get_sentence(timeout=0)
+    assert str(sentence1) == "Sentence(text='Goodbye, ', emotion='sad', is_finished=True)", f"Got: {sentence1}"
+    assert str(sentence2) == "Sentence(text='cruel world!', emotion='angry', is_finished=True)", f"Got: {sentence2}"
+    assert queue.get_sentence(timeout=0.01) is None
 
-    sentence1 = queue.get_sentence()
-    sentence2 = queue.get_sentence()
-    assert str(sentence1) == "Sentence(text='Goodbye, ', emotion='sad', is_finished=True)", f"Test 2a failed. Got: {sentence1}"
-    assert str(sentence2) == "Sentence(text='cruel world!', emotion='angry', is_finished=True)", f"Test 2b failed. Got: {sentence2}"
-    print("Test 2 passed: Multiple sentences with emotion changes")
-
-    # Test 3: Empty queue behavior
-    empty_sentence = queue.get_sentence()
-    assert empty_sentence is None, f"Test 3 failed. Got: {empty_sentence}"
-    print("Test 3 passed: Empty queue behavior")
-
-    # Test 4: Thread safety, live updates, and consistent sentence length
-    def worker(worker_id):
-        for i in range(100):
-            queue.add_emotion(f"emotion{worker_id}")
-            queue.add_text("This ")
-            queue.add_text("is ")
-            queue.add_text("test ")
-            queue.add_text("sentence ")
-            queue.add_text(f"{i}. ")
-            queue.finish_current_sentence()
-
-    threads = [threading.Thread(target=worker, args=(i,)) for i in range(5)]
-    for thread in threads:
-        thread.start()
+    # a running sentence is handed out once, the end of the turn once
+    queue.add_emotion("happy")
+    queue.add_text("Still ")
+    running = queue.get_sentence(timeout=0)
+    assert running is not None and not running.get_finished()
+    assert queue.get_sentence(timeout=0.01) is None
+    queue.add_text("writing.")
+    queue.finish_turn()
+    assert running.get_finished() and running.get_text() == "Still writing."
+    assert queue.wait_until_drained(timeout=0)
+    assert queue.get_sentence(timeout=0) is None and queue.drained_generation == queue.generation
+    assert queue.get_sentence(timeout=0.01) is None
+
+    # clear() drops a stale turn, new sentences carry the new generation
+    queue.add_text("Stale.")
+    queue.finish_current_sentence()
+    queue.clear(7)
+    queue.add_text("Fresh.")
+    queue.finish_current_sentence()
+    sentence = queue.get_sentence(timeout=0)
+    assert sentence.get_text() == "Fresh." and sentence.generation == 7
+
+    # readers follow a running sentence from their own offset
+    sentence = Sentence("happy")
+    sentence.add_text("One ")
+    sentence.add_text("two ")
+    fragments, offset, finished = sentence.read_since(0, timeout=0)
+    assert fragments == ["One ", "two "] and offset == 2 and not finished
+    assert sentence.read_since(offset, timeout=0.01) == ([], 2, False)
+    sentence.add_text("three.")
+    sentence.mark_finished()
+    assert sentence.read_since(offset, timeout=0) == (["three."], 3, True)
+    assert sentence.get_text() == "One two three."
+
+    # with a segmenter, units are queued finished and emotions flush them
+    queue = ThreadSafeSentenceQueue(SentenceSegmenter())
+    queue.add_emotion("happy")
+    assert not queue.add_text("Well, ")
+    assert queue.add_text("you know, it is fine. And")
+    queue.add_emotion("sad")
+    queue.add_text(" bye.")
+    queue.finish_turn()
+    units = [queue.get_sentence(timeout=0) for _ in range(4)]
+    assert [(unit.get_text(), unit.emotion, unit.final) for unit in units[:3]] == [
+        ("Well, you know,", "happy", False), ("it is fine.", "happy", True), ("And", "happy", True)], units
+    assert units[3].get_text() == "bye." and units[3].emotion == "sad"
+    assert queue.get_sentence(timeout=0) is None and queue.drained_generation == queue.generation
+    print("Queue checks passed")
+
+
+def blocking_consumer(queue, count, received):
+    while len(received) < count:
+        sentence = queue.get_sentence(timeout=1.0)
+        if sentence is not None:
+            received.append((time.perf_counter(), sentence))
 
-    # Simulate a TTS thread reading sentences
-    tts_sentences = []
-    start_time = time.time()
-    timeout = 10  # Set a timeout of 10 seconds
-    while len(tts_sentences) < 500 and time.time() - start_time < timeout:
-        sentence = queue.get_sentence()
-        if sentence:
-            tts_sentences.append(sentence)
-        time.sleep(0.001)  # Simulate some processing time
 
+def polling_consumer(queue, count, received):
+    # the former worker loop
+    while len(received) < count:
+        sentence = queue.get_sentence(timeout=0)
+        if sentence is not None:
+            received.append((time.perf_counter(), sentence))
+            continue
+        time.sleep(0.01)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def benchmark_wakeup(consumer, count: int = 200, seed: int = 42):
+    rng = random.Random(seed)
+    queue = ThreadSafeSentenceQueue()
+    received = []
+    available_at = []
+    thread = threading.Thread(target=consumer, args=(queue, count, received))
+    thread.start()
+    for i in range(count):
+        time.sleep(rng.uniform(0.001, 0.02))
+        available_at.append(time.perf_counter())
+        queue.add_emotion("neutral")  # the new sentence can be handed out from here
+        queue.add_text(f"Sentence {i}.")
+        queue.finish_current_sentence()
+    thread.join()
+    return [(at - available) * 1000 for (at, _), available in zip(received, available_at)]
+
+
+def polling_reader(sentence, received):
+    # the former tts_play_sentence loop
+    last_text = ""
+    while not sentence.get_finished():
+        current_text = sentence.get_text()
+        if len(current_text) > len(last_text):
+            received.append((time.perf_counter(), len(current_text)))
+        last_text = current_text
+        time.sleep(0.01)
+
+
+def offset_reader(sentence, received):
+    offset, length, finished = 0, 0, False
+    while not finished:
+        fragments, offset, finished = sentence.read_since(offset, timeout=0.1)
+        if fragments:
+            length += sum(len(fragment) for fragment in fragments)
+            received.append((time.perf_counter(), length))
+
+
+def benchmark_fragments(reader, tokens: int = 300, seed: int = 42):
+    rng = random.Random(seed)
+    sentence = Sentence("neutral")
+    received = []
+    written = []
+    thread = threading.Thread(target=reader, args=(sentence, received))
+    thread.start()
+    length = 0
+    for i in range(tokens):
+        time.sleep(rng.uniform(0.002, 0.03))  # LLM token intervals
+        token = f" word{i}"
+        length += len(token)
+        written.append((time.perf_counter(), length))
+        sentence.add_text(token)
+    sentence.mark_finished()
+    thread.join()
+    # for every write, when did the reader first have at least that much text
+    delays = []
+    index = 0
+    for at, length in written:
+        while index < len(received) and received[index][1] < length:
+            index += 1
+        if index < len(received):
+            delays.append((received[index][0] - at) * 1000)
+    return delays
+
+
+def benchmark_throughput(consumer, producers: int = 4, sentences: int = 5000):
+    queue = ThreadSafeSentenceQueue()
+    received = []
+    per_producer = sentences // producers
+    lock = threading.Lock()
+
+    def produce():
+        for i in range(per_producer):
+            with lock:  # one sentence at a time, as the LLM thread writes them
+                queue.add_emotion("neutral")
+                queue.add_text(f"This is test sentence {i}. ")
+                queue.finish_current_sentence()
+
+    start = time.perf_counter()
+    consumer_thread = threading.Thread(target=consumer, args=(queue, per_producer * producers, received))
+    consumer_thread.start()
+    threads = [threading.Thread(target=produce) for _ in range(producers)]
+    for thread in threads:
+        thread.start()
     for thread in threads:
         thread.join()
+    consumer_thread.join()
+    elapsed = time.perf_counter() - start
+    assert all(len(sentence.get_text().split()) == 5 for _, sentence in received)
+    return len(received) / elapsed
 
-    assert len(tts_sentences) == 500, f"Test 4 failed. Expected 500 sentences, got {len(tts_sentences)}"
-    assert all(s.is_finished for s in tts_sentences), "Test 4 failed. Not all sentences are marked as finished"
-    assert all(len(s.text.split()) == 5 for s in tts_sentences), f"Test 4 failed. Not all sentences have 5 words. Example: {next((s for s in tts_sentences if len(s.text.split()) != 5), None)}"
-    print(f"Test 4 passed: Thread safety, live updates, and consistent sentence length. Processed {len(tts_sentences)} sentences.")
-
-    print("All tests passed successfully!")
 
 if __name__ == "__main__":
-    test_sentence_queue()
-
-
-# import threading
-# import time
-# from typing import Optional
-# from sentencequeue import ThreadSafeSentenceQueue, Sentence
-
-# # Include the updated ThreadSafeSentenceQueue and Sentence classes here
-
-# def test_sentence_queue():
-#     queue = ThreadSafeSentenceQueue()
-
-#     # Test 1: Basic functionality and live updates
-#     queue.add_emotion("happy")
-#     queue.add_text("Hello, ")
-#     sentence = queue.get_sentence()
-#     assert str(sentence) == "Sentence(text='Hello, ', emotion='happy', is_finished=False)", f"Test 1a failed. Got: {sentence}"
-#     queue.add_text("world!")
-#     assert str(sentence) == "Sentence(text='Hello, world!', emotion='happy', is_finished=False)", f"Test 1b failed. Got: {sentence}"
-#     queue.finish_current_sentence()
-#     assert str(sentence) == "Sentence(text='Hello, world!', emotion='happy', is_finished=True)", f"Test 1c failed. Got: {sentence}"
-#     print("Test 1 passed: Basic functionality and live updates")
-
-#     # Test 2: Multiple sentences with emotion changes
-#     queue.add_emotion("sad")
-#     queue.add_text("Goodbye, ")
-#     queue.add_emotion("angry")  # This should finish the previous sentence and start a new one
-#     queue.add_text("cruel ")
-#     queue.add_text("world!")
-#     queue.finish_current_sentence()
-
-#     sentence1 = queue.get_sentence()
-#     sentence2 = queue.get_sentence()
-#     assert str(sentence1) == "Sentence(text='Goodbye, ', emotion='sad', is_finished=True)", f"Test 2a failed. Got: {sentence1}"
-#     assert str(sentence2) == "Sentence(text='cruel world!', emotion='angry', is_finished=True)", f"Test 2b failed. Got: {sentence2}"
-#     print("Test 2 passed: Multiple sentences with emotion changes")
-
-#     # Test 3: Empty queue behavior
-#     empty_sentence = queue.get_sentence()
-#     assert empty_sentence is None, f"Test 3 failed. Got: {empty_sentence}"
-#     print("Test 3 passed: Empty queue behavior")
-
-#     # Test 4: Thread safety and live updates
-#     def worker(worker_id):
-#         for i in range(100):
-#             queue.add_emotion(f"emotion{worker_id}")
-#             for j in range(5):
-#                 queue.add_text(f"Text {j} ")
-#                 time.sleep(0.001)  # Simulate some processing time
-#             queue.finish_current_sentence()
-
-#     threads = [threading.Thread(target=worker, args=(i,)) for i in range(5)]
-#     for thread in threads:
-#         thread.start()
-
-#     # Simulate a TTS thread reading sentences
-#     tts_sentences = []
-#     while len(tts_sentences) < 500 or not all(s.is_finished for s in tts_sentences):
-#         sentence = queue.get_sentence()
-#         if sentence and sentence not in tts_sentences:
-#             tts_sentences.append(sentence)
-#         time.sleep(0.001)  # Simulate some processing time
-
-#     for thread in threads:
-#         thread.join()
-
-#     assert len(tts_sentences) == 500, f"Test 4 failed. Expected 500 sentences, got {len(tts_sentences)}"
-#     assert all(s.is_finished for s in tts_sentences), "Test 4 failed. Not all sentences are marked as finished"
-#     assert all(len(s.text.split()) == 5 for s in tts_sentences), "Test 4 failed. Not all sentences have 5 words"
-#     print(f"Test 4 passed: Thread safety and live updates. Processed {len(tts_sentences)} sentences.")
-
-#     print("All tests passed successfully!")
-
-# if __name__ == "__main__":
-#     test_sentence_queue()
\ No newline at end of file
+    check_queue()
+
+    print("\nWake-up latency, new sentence to get_sentence() return:")
+    for name, consumer in (("polling 10 ms", polling_consumer), ("blocking", blocking_consumer)):
+        delays = benchmark_wakeup(consumer)
+        print(f"  {name:14s} p50 {percentile(delays, 0.5):7.3f} ms   p95 {percentile(delays, 0.95):7.3f} ms   max {max(delays):7.3f} ms")
+
+    print("\nFragment delay, add_text() to the TTS side:")
+    for name, reader in (("get_text 10 ms", polling_reader), ("read_since", offset_reader)):
+        delays = benchmark_fragments(reader)
+        print(f"  {name:14s} p50 {percentile(delays, 0.5):7.3f} ms   p95 {percentile(delays, 0.95):7.3f} ms   max {max(delays):7.3f} ms")
+
+    print("\nThroughput, 4 producer threads:")
+    for name, consumer in (("polling 10 ms", polling_consumer), ("blocking", blocking_consumer)):
+        print(f"  {name:14s} {benchmark_throughput(consumer):10.0f} sentences/s")
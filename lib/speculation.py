@@ -0,0 +1,169 @@
+import re
+import threading
+import time
+from typing import Callable, List, Optional
+from lib.turntrace import tracer
+
+_NON_WORD = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_transcript(text: str) -> str:
+    """Compare transcripts ignoring case, punctuation and spacing."""
+    text = _NON_WORD.sub('', text.lower())
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class SpeculativeResponder:
+    """
+    Starts the LLM request on a stable partial transcript while the user is
+    still finishing the utterance.
+
+    Tokens of the speculative stream are buffered. When the final transcript
+    matches the speculated one, commit() succeeds and attach() replays the
+    buffer into the real token callback and forwards the rest live. When it
+    diverges, the speculative request is cancelled and its user message is
+    removed from the history again, so the normal path can run.
+    """
+    def __init__(
+            self,
+            llm_handler,
+            system_prompt: str,
+            min_chars: int = 12,
+            stable_delay: float = 0.3):
+
+        self.llm_handler = llm_handler
+        self.system_prompt = system_prompt
+        self.min_chars = min_chars
+        self.stable_delay = stable_delay
+
+        self.control_lock = threading.Lock()  # serializes start/commit/cancel
+        self.token_lock = threading.Lock()    # guards the token buffer
+        self.timer: Optional[threading.Timer] = None
+        self.thread: Optional[threading.Thread] = None
+        self.suspended = True
+        self.key = ""
+        self.start_time = 0.0
+        self.request_time = None   # perf_counter times for the turn trace
+        self.first_token_time = None
+        self.tokens: List[str] = []
+        self.sink: Optional[Callable[[str], None]] = None
+
+        self.stats = {
+            "started": 0,
+            "hits": 0,
+            "misses": 0,
+            "cancelled": 0,
+            "last_lead_time": 0.0,
+        }
+
+    def resume(self) -> None:
+        """Accept partial transcripts again (the user has the floor)."""
+        self.suspended = False
+
+    def update(self, partial_text: str) -> None:
+        """Feed a stabilized partial transcript from the recorder."""
+        if self.suspended:
+            return
+        key = normalize_transcript(partial_text)
+        if len(key) < self.min_chars or key == self.key:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        # only speculate once the partial stopped changing for a moment
+        self.timer = threading.Timer(self.stable_delay, self._start, args=(partial_text, key))
+        self.timer.daemon = True
+        self.timer.start()
+
+    def commit(self, final_text: str) -> bool:
+        """
+        Decide on the final transcript. Returns True if the running
+        speculative request answers exactly this text, then attach() must
+        be called to consume it.
+        """
+        self.suspended = True
+        with self.control_lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.thread is None:
+                return False
+            if normalize_transcript(final_text) == self.key:
+                self.stats["hits"] += 1
+                self.stats["last_lead_time"] = time.time() - self.start_time
+                # keep the final wording (punctuation, casing) in the history
+                self.llm_handler.conversation.pop_message()
+                self.llm_handler.add_user_text(final_text)
+                return True
+            self.stats["misses"] += 1
+            self._cancel()
+            return False
+
+    def attach(self, on_token: Callable[[str], None]) -> None:
+        """Stream the committed response into on_token, blocks until it is complete."""
+        # the request went out before the turn started, report its real times
+        tracer.mark("request_sent", self.request_time)
+        if self.first_token_time is not None:
+            tracer.mark("first_token", self.first_token_time)
+        with self.token_lock:
+            for token in self.tokens:
+                on_token(token)
+            self.tokens = []
+            self.sink = on_token
+        with self.control_lock:
+            self.thread.join()
+            self.thread = None
+            self.key = ""
+            self.sink = None
+
+    def cancel(self) -> None:
+        self.suspended = True
+        with self.control_lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self._cancel()
+
+    def _start(self, text: str, key: str) -> None:
+        with self.control_lock:
+            if self.suspended or key == self.key:
+                return
+            self._cancel()
+            self.key = key
+            self.tokens = []
+            self.sink = None
+            self.start_time = time.time()
+            self.request_time = time.perf_counter()
+            self.first_token_time = None
+            self.stats["started"] += 1
+            # added here, not in the thread, so commit() and _cancel() always
+            # find it as the last message when they replace or roll it back
+            self.llm_handler.add_user_text(text)
+            self.llm_handler.begin_turn()
+            self.thread = threading.Thread(target=self._generate, daemon=True)
+            self.thread.start()
+
+    def _generate(self) -> None:
+        self.llm_handler.generate_response(self.system_prompt, on_token=self._on_token)
+
+    def _on_token(self, token: str) -> None:
+        with self.token_lock:
+            if self.first_token_time is None:
+                self.first_token_time = time.perf_counter()
+            if self.sink is None:
+                self.tokens.append(token)
+                return
+        self.sink(token)
+
+    def _cancel(self) -> None:
+        # caller holds control_lock
+        if self.thread is None:
+            return
+        self.llm_handler.cancel()
+        self.thread.join()
+        # roll back the speculative user message
+        self.llm_handler.conversation.pop_message()
+        self.stats["cancelled"] += 1
+        self.thread = None
+        self.key = ""
+        self.tokens = []
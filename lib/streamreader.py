@@ -0,0 +1,132 @@
+import codecs
+import json
+import logging
+from typing import Any, Iterator, List, Optional
+
+try:
+    # optional, several times faster than the stdlib decoder and parses
+    # straight from a memoryview of the receive buffer
+    import orjson
+    _loads = orjson.loads
+    _LOADS_VIEW = True
+except ImportError:
+    _loads = None
+    _LOADS_VIEW = False
+
+# Yielded for the SSE "data: [DONE]" end marker
+DONE = object()
+
+logger = logging.getLogger(__name__)
+
+
+class StreamEventReader:
+    """
+    Incremental splitter for streamed LLM responses.
+
+    Takes raw body bytes as they arrive and returns every complete event as
+    soon as its terminating newline is in: the decoded JSON of SSE
+    "data:" lines (other SSE fields are skipped) or of NDJSON lines.
+    Lines are parsed in place without copying them out of the buffer:
+    with orjson from a memoryview of the bytes, otherwise the chunk is
+    decoded to str once and json's raw_decode parses at the line offset.
+    """
+    def __init__(self, format: str = "sse"):
+        if format not in ("sse", "ndjson"):
+            raise ValueError(f"Unknown stream format: {format}")
+        self.sse = format == "sse"
+        self.decode_errors = 0
+        if _LOADS_VIEW:
+            self.buffer = bytearray()
+            self.newline, self.prefix, self.done = b"\n", b"data:", b"[DONE]"
+        else:
+            self.buffer = ""
+            self.utf8 = codecs.getincrementaldecoder("utf-8")()
+            self.json_decoder = json.JSONDecoder()
+            self.newline, self.prefix, self.done = "\n", "data:", "[DONE]"
+
+    def feed(self, data: bytes) -> List[Any]:
+        if _LOADS_VIEW:
+            self.buffer += data
+            view = memoryview(self.buffer)
+        else:
+            self.buffer += self.utf8.decode(data)
+            view = None
+        buffer = self.buffer
+        events = []
+        start = 0
+        try:
+            while True:
+                end = buffer.find(self.newline, start)
+                if end < 0:
+                    break
+                self._parse(view, start, end, events)
+                start = end + 1
+        finally:
+            if view is not None:
+                view.release()
+        if start:
+            if _LOADS_VIEW:
+                del self.buffer[:start]
+            else:
+                self.buffer = buffer[start:]
+        return events
+
+    def flush(self) -> List[Any]:
+        """Parse a last line that was not terminated by a newline."""
+        events = []
+        if self.buffer:
+            view = memoryview(self.buffer) if _LOADS_VIEW else None
+            try:
+                self._parse(view, 0, len(self.buffer), events)
+            finally:
+                if view is not None:
+                    view.release()
+            self.buffer = self.buffer[:0]
+        return events
+
+    def _parse(self, view: Optional[memoryview], start: int, end: int, events: List[Any]) -> None:
+        buffer = self.buffer
+        if end > start and buffer[end - 1] in (13, "\r"):  # \r\n line ending
+            end -= 1
+        if self.sse:
+            if not buffer.startswith(self.prefix, start, end):
+                return
+            start += 5
+            if start < end and buffer[start] in (32, " "):
+                start += 1
+            if end - start == 6 and buffer.startswith(self.done, start):
+                events.append(DONE)
+                return
+        if start >= end:
+            return
+        try:
+            if view is not None:
+                events.append(_loads(view[start:end]))
+            else:
+                # raw_decode does not skip leading whitespace, json.loads and orjson do
+                while start < end and buffer[start].isspace():
+                    start += 1
+                events.append(self.json_decoder.raw_decode(buffer, start)[0])
+        except ValueError:
+            self.decode_errors += 1
+            logger.error(f"Error decoding JSON: {buffer[start:end]}")
+
+
+def iter_response_events(response, format: str = "sse", chunk_size: int = 65536) -> Iterator[Any]:
+    """
+    Yield the events of a streamed requests response. Reads with read1(),
+    which returns whatever bytes are available instead of waiting for a
+    full chunk_size block, so a small token event is never held back.
+    """
+    reader = StreamEventReader(format)
+    raw = response.raw
+    if hasattr(raw, "read1"):
+        while True:
+            data = raw.read1(chunk_size)
+            if not data:
+                break
+            yield from reader.feed(data)
+    else:
+        for data in raw.stream(chunk_size):
+            yield from reader.feed(data)
+    yield from reader.flush()
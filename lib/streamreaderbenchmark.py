@@ -0,0 +1,153 @@
+import io
+import json
+import socket
+import threading
+import time
+import requests
+from streamreader import DONE, StreamEventReader, iter_response_events, _LOADS_VIEW
+
+# Compares the former response.iter_lines() + decode + json.loads loop with
+# StreamEventReader. A local stand-in server streams token events with a
+# timestamp at a fixed interval, the client measures how long each event
+# took from the server write to the parsed object.
+#
+#   python streamreaderbenchmark.py
+
+
+def sse_event(token: str) -> bytes:
+    event = {"choices": [{"delta": {"content": token}, "finish_reason": None}], "t": time.perf_counter()}
+    return b"data: " + json.dumps(event).encode() + b"\n\n"
+
+
+class StandInServer:
+    """Minimal HTTP server that streams num_events SSE events per request."""
+    def __init__(self, num_events: int = 200, interval: float = 0.005, chunked: bool = False):
+        self.num_events = num_events
+        self.interval = interval
+        self.chunked = chunked
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}/v1/chat/completions"
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        request = b""
+        while b"\r\n\r\n" not in request:
+            request += conn.recv(65536)
+        headers, _, body = request.partition(b"\r\n\r\n")
+        length = int([line.split(b":")[1] for line in headers.split(b"\r\n") if line.lower().startswith(b"content-length")][0])
+        while len(body) < length:
+            body += conn.recv(65536)
+
+        if self.chunked:
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        else:
+            # no length and no chunking, the body ends when the connection closes
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+
+        def send(data: bytes):
+            conn.sendall(b"%x\r\n%s\r\n" % (len(data), data) if self.chunked else data)
+
+        for i in range(self.num_events):
+            send(sse_event(f" tok{i}"))
+            time.sleep(self.interval)
+        send(b"data: [DONE]\n\n")
+        if self.chunked:
+            conn.sendall(b"0\r\n\r\n")
+        conn.close()
+
+
+def legacy_delays(url: str):
+    delays = []
+    response = requests.post(url, json={}, stream=True)
+    for line in response.iter_lines():
+        now = time.perf_counter()
+        if line:
+            line = line.decode('utf-8')
+            if line.startswith("data: "):
+                if line[6:].strip() == "[DONE]":
+                    break
+                delays.append(now - json.loads(line[6:])["t"])
+    response.close()
+    return delays
+
+
+def reader_delays(url: str):
+    delays = []
+    response = requests.post(url, json={}, stream=True)
+    for event in iter_response_events(response, "sse"):
+        now = time.perf_counter()
+        if event is DONE:
+            break
+        delays.append(now - event["t"])
+    response.close()
+    return delays
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def benchmark_delivery():
+    print("Per-token delivery delay (server write to parsed event)")
+    print(f"{'mode':<10}{'reader':<14}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for chunked in (False, True):
+        server = StandInServer(chunked=chunked)
+        for name, func in (("iter_lines", legacy_delays), ("stream", reader_delays)):
+            delays = [d * 1000 for d in func(server.url)]
+            mode = "chunked" if chunked else "close"
+            print(f"{mode:<10}{name:<14}{sum(delays) / len(delays):>10.2f}{percentile(delays, 50):>10.2f}"
+                  f"{percentile(delays, 95):>10.2f}{max(delays):>10.2f}")
+
+
+def make_body(num_events: int) -> bytes:
+    return b"".join(sse_event(f" tok{i}") for i in range(num_events)) + b"data: [DONE]\n\n"
+
+
+def legacy_parse(body: bytes) -> int:
+    response = requests.models.Response()
+    response.raw = io.BytesIO(body)
+    count = 0
+    for line in response.iter_lines():
+        if line:
+            line = line.decode('utf-8')
+            if line.startswith("data: ") and line[6:].strip() != "[DONE]":
+                json.loads(line[6:])
+                count += 1
+    return count
+
+
+def reader_parse(body: bytes) -> int:
+    reader = StreamEventReader("sse")
+    count = 0
+    for pos in range(0, len(body), 65536):
+        for event in reader.feed(body[pos:pos + 65536]):
+            if event is not DONE:
+                count += 1
+    return count
+
+
+def benchmark_parse(num_events: int = 100000):
+    body = make_body(num_events)
+    print(f"\nParse throughput, {num_events} events, {len(body) / 1e6:.1f} MB"
+          f" ({'orjson' if _LOADS_VIEW else 'stdlib json'})")
+    for name, func in (("iter_lines", legacy_parse), ("stream", reader_parse)):
+        start_time = time.perf_counter()
+        count = func(body)
+        elapsed = time.perf_counter() - start_time
+        assert count == num_events, f"{name} parsed {count} events"
+        print(f"{name:<14}{count / elapsed / 1000:>10.0f}k events/s{elapsed * 1e6 / count:>10.2f} us/event")
+
+
+if __name__ == '__main__':
+    benchmark_delivery()
+    benchmark_parse()
@@ -0,0 +1,98 @@
+import re
+from typing import List, Optional, Tuple
+
+# (text, None) for spoken text, (None, emotion) for an [emotion] tag
+StreamEvent = Tuple[Optional[str], Optional[str]]
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class EmotionTextStream:
+    """
+    Incremental parser for LLM token streams of the form "[emotion] text".
+
+    Whole token chunks are scanned at once. Only a small carry-over state is
+    kept between tokens (whether the last emitted character was whitespace and
+    the parts of an [emotion] tag that is split across tokens), so the cost
+    per input byte stays constant no matter how long the response gets.
+
+    Text normalization matches the former Main.process_plain_text: line breaks
+    are removed, leading whitespace is dropped and whitespace runs collapse
+    into a single space.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear all state before a new response."""
+        self._raw_parts: List[str] = []
+        self._tag_parts: List[str] = []
+        self._in_emotion: bool = False
+        self._emitted_text: bool = False
+        self._last_space: bool = False
+
+    def feed(self, token: str) -> List[StreamEvent]:
+        """Parse the next token and return the events it completes."""
+        self._raw_parts.append(token)
+        events: List[StreamEvent] = []
+        pos = 0
+        end = len(token)
+
+        while pos < end:
+            if self._in_emotion:
+                close = token.find(']', pos)
+                reopen = token.find('[', pos)
+                if reopen != -1 and (close == -1 or reopen < close):
+                    # A new tag starts before this one closed: the dangling
+                    # "[..." is treated as plain text
+                    self._tag_parts.append(token[pos:reopen])
+                    self._emit_text(''.join(self._tag_parts), events)
+                    self._tag_parts = ['[']
+                    pos = reopen + 1
+                elif close != -1:
+                    self._tag_parts.append(token[pos:close])
+                    events.append((None, ''.join(self._tag_parts)[1:].lower()))
+                    self._tag_parts = []
+                    self._in_emotion = False
+                    pos = close + 1
+                else:
+                    self._tag_parts.append(token[pos:])
+                    pos = end
+            else:
+                start = token.find('[', pos)
+                if start == -1:
+                    self._emit_text(token[pos:], events)
+                    pos = end
+                else:
+                    self._emit_text(token[pos:start], events)
+                    self._tag_parts = ['[']
+                    self._in_emotion = True
+                    pos = start + 1
+
+        return events
+
+    def flush(self) -> List[StreamEvent]:
+        """Finish the response, emitting an unterminated tag as plain text."""
+        events: List[StreamEvent] = []
+        if self._in_emotion:
+            self._emit_text(''.join(self._tag_parts), events)
+            self._tag_parts = []
+            self._in_emotion = False
+        return events
+
+    def raw_text(self) -> str:
+        """Return the complete unprocessed response including emotion tags."""
+        return ''.join(self._raw_parts)
+
+    def _emit_text(self, text: str, events: List[StreamEvent]) -> None:
+        text = text.replace('\n', '')
+        if not text:
+            return
+        text = _WHITESPACE.sub(' ', text)
+        if text[0] == ' ' and (self._last_space or not self._emitted_text):
+            text = text[1:]
+            if not text:
+                return
+        self._emitted_text = True
+        self._last_space = text[-1] == ' '
+        events.append((text, None))
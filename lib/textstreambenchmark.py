@@ -0,0 +1,117 @@
+import random
+import re
+import time
+from textstream import EmotionTextStream
+
+
+class LegacyTokenProcessor:
+    """Character-by-character parser formerly used in Main.process_llm_token."""
+    def __init__(self):
+        self.plain_text = ""
+        self.last_plain_text = ""
+        self.buffer = ""
+        self.in_emotion = False
+        self.events = []
+
+    def process_llm_token(self, token: str):
+        for char in token:
+            if char == '[':
+                if self.buffer:
+                    self.process_buffer()
+                self.buffer = '['
+                self.in_emotion = True
+            elif char == ']' and self.in_emotion:
+                self.events.append((None, self.buffer[1:].lower()))
+                self.buffer = ""
+                self.in_emotion = False
+            else:
+                self.buffer += char
+                if not self.in_emotion and self.buffer:
+                    self.process_buffer()
+
+    def process_buffer(self):
+        self.plain_text += self.buffer
+        self.plain_text = re.sub(r'\n', '', self.plain_text)
+        self.plain_text = re.sub(r'^\s+', '', self.plain_text)
+        self.plain_text = re.sub(r'\s+', ' ', self.plain_text)
+        new_text = self.plain_text[len(self.last_plain_text):]
+        self.last_plain_text = self.plain_text
+        if new_text:
+            self.events.append((new_text, None))
+        self.buffer = ""
+
+    def flush(self):
+        if self.buffer:
+            self.process_buffer()
+
+
+def make_tokens(num_chars: int, seed: int = 42):
+    rng = random.Random(seed)
+    words = ["hello", "there", "poker", "night", "Vegas", "lucky", "sure", "why", "not"]
+    emotions = ["cheerful", "calm", "sarcastic", "excited", "unknown"]
+    parts = []
+    length = 0
+    while length < num_chars:
+        part = f"[{rng.choice(emotions)}] " if rng.random() < 0.05 else rng.choice(words)
+        part += rng.choice([" ", " ", "  ", ", ", ".\n", "! "])
+        parts.append(part)
+        length += len(part)
+    text = "".join(parts)
+
+    # cut into token-sized pieces that also split emotion tags
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 6)
+        tokens.append(text[pos:pos + size])
+        pos += size
+    return tokens
+
+
+def merge_text_events(events):
+    merged = []
+    for text, emotion in events:
+        if text is not None and merged and merged[-1][0] is not None:
+            merged[-1] = (merged[-1][0] + text, None)
+        else:
+            merged.append((text, emotion))
+    return merged
+
+
+def check_equivalence():
+    for seed in range(50):
+        tokens = make_tokens(2000, seed)
+        legacy = LegacyTokenProcessor()
+        stream = EmotionTextStream()
+        events = []
+        for token in tokens:
+            legacy.process_llm_token(token)
+            events.extend(stream.feed(token))
+        legacy.flush()
+        events.extend(stream.flush())
+        assert merge_text_events(events) == merge_text_events(legacy.events), f"Mismatch for seed {seed}"
+        assert stream.raw_text() == "".join(tokens)
+    print("Equivalence check passed: streaming parser matches the legacy output")
+
+
+def time_per_token(tokens, feed):
+    start = time.perf_counter()
+    for token in tokens:
+        feed(token)
+    return (time.perf_counter() - start) / len(tokens) * 1e6
+
+
+def run_benchmark():
+    print(f"{'chars':>8} {'tokens':>8} {'legacy us/token':>16} {'stream us/token':>16}")
+    for num_chars in (1000, 5000, 10000, 20000, 40000):
+        tokens = make_tokens(num_chars)
+        legacy = LegacyTokenProcessor()
+        stream = EmotionTextStream()
+        legacy_cost = time_per_token(tokens, legacy.process_llm_token)
+        stream_cost = time_per_token(tokens, stream.feed)
+        print(f"{num_chars:>8} {len(tokens):>8} {legacy_cost:>16.2f} {stream_cost:>16.2f}")
+
+
+if __name__ == "__main__":
+    check_equivalence()
+    run_benchmark()
@@ -0,0 +1,136 @@
+import functools
+import logging
+import math
+import threading
+from typing import Callable, Dict
+
+# Tokenizer specs, set with "tokenizer" in completion_params.json:
+#
+#   "tiktoken:gpt-4o"            OpenAI model name or encoding (needs tiktoken)
+#   "hf:path/to/tokenizer.json"  offline HuggingFace tokenizer file (needs tokenizers)
+#   "gpt2"                       GPT-2 tokenizer from transformers
+#   "estimate:llama3"            calibrated characters-per-token estimate, by
+#   "estimate:3.6"               model family or as a plain ratio
+#
+# Real tokenizers load lazily on first use. If the library or file is
+# missing the counter falls back to the estimate and logs a warning once.
+
+# average characters per token on English chat text, measured per family
+CHARS_PER_TOKEN = {
+    "gpt": 4.0,
+    "gpt2": 3.9,
+    "llama3": 3.8,
+    "llama2": 3.4,
+    "mistral": 3.3,
+    "claude": 3.5,
+    "default": 3.5,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    """Counts the tokens of a text, results are memoized per text."""
+    def __init__(self, spec: str, cache_size: int = 4096):
+        self.spec = spec
+        self.count = functools.lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def __call__(self, text: str) -> int:
+        return self.count(text)
+
+
+class EstimateCounter(TokenCounter):
+    def __init__(self, spec: str, chars_per_token: float):
+        super().__init__(spec)
+        self.chars_per_token = chars_per_token
+
+    def _count(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token) if text else 0
+
+
+class LazyCounter(TokenCounter):
+    """Loads the real tokenizer on first use, falls back to an estimate."""
+    def __init__(self, spec: str, loader: Callable[[], Callable[[str], int]], fallback: str = "default"):
+        super().__init__(spec)
+        self.loader = loader
+        self.fallback = fallback
+        self.encode_count = None
+        self.lock = threading.Lock()
+
+    def _count(self, text: str) -> int:
+        if self.encode_count is None:
+            with self.lock:
+                if self.encode_count is None:
+                    self.encode_count = self.load()
+        return self.encode_count(text)
+
+    def load(self) -> Callable[[str], int]:
+        try:
+            return self.loader()
+        except Exception as e:
+            logger.warning(f"Tokenizer {self.spec} not available ({e}), estimating token counts")
+            return EstimateCounter(self.spec, CHARS_PER_TOKEN[self.fallback])
+
+
+def _tiktoken_counter(name: str) -> TokenCounter:
+    def load():
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(name)
+        except KeyError:
+            encoding = tiktoken.get_encoding(name)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    return LazyCounter(f"tiktoken:{name}", load, fallback="gpt")
+
+
+def _hf_counter(path: str) -> TokenCounter:
+    def load():
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_file(path)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return LazyCounter(f"hf:{path}", load)
+
+
+def _gpt2_counter(_: str) -> TokenCounter:
+    def load():
+        from transformers import GPT2Tokenizer
+        tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+        return lambda text: len(tokenizer.encode(text))
+    return LazyCounter("gpt2", load, fallback="gpt2")
+
+
+def _estimate_counter(arg: str) -> TokenCounter:
+    arg = arg or "default"
+    chars_per_token = CHARS_PER_TOKEN[arg] if arg in CHARS_PER_TOKEN else float(arg)
+    return EstimateCounter(f"estimate:{arg}", chars_per_token)
+
+
+TOKENIZERS: Dict[str, Callable[[str], TokenCounter]] = {
+    "tiktoken": _tiktoken_counter,
+    "hf": _hf_counter,
+    "gpt2": _gpt2_counter,
+    "estimate": _estimate_counter,
+}
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def register_tokenizer(scheme: str, factory: Callable[[str], TokenCounter]) -> None:
+    TOKENIZERS[scheme] = factory
+
+
+def get_token_counter(spec: str) -> TokenCounter:
+    """Return the shared counter for a tokenizer spec like "tiktoken:gpt-4o"."""
+    with _counters_lock:
+        counter = _counters.get(spec)
+        if counter is None:
+            scheme, _, arg = spec.partition(":")
+            if scheme not in TOKENIZERS:
+                raise ValueError(f"Unknown tokenizer: {spec}")
+            counter = TOKENIZERS[scheme](arg)
+            _counters[spec] = counter
+        return counter
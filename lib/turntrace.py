@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Timeline points of a turn, in the order they usually happen
+TURN_MARKS = (
+    "speech_end",
+    "transcript_ready",
+    "request_sent",
+    "first_token",
+    "first_emotion",
+    "first_sentence_queued",
+    "first_audio_chunk",
+    "first_sample_played",
+    "last_sample_played",
+)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Linear interpolated percentile, p in 0..100."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    pos = (len(values) - 1) * p / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+class TurnTracer:
+    """
+    Collects timestamps of the points in TURN_MARKS for every turn.
+
+    Each mark keeps its first occurrence only, so callers can mark on every
+    token or chunk without bookkeeping. Marks outside of a turn are ignored.
+    Finished turns are appended to a JSONL file (one record per turn) or
+    written as a Chrome trace (chrome://tracing, ui.perfetto.dev).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.output_file = ""
+        self.format = "jsonl"
+        self.session_start = time.perf_counter()
+        self.turn: Optional[Dict[str, float]] = None
+        self.turn_info: Dict = {}
+        self.turns: List[Dict] = []
+
+    def configure(self, output_file: str = "", format: str = "jsonl", enabled: bool = True) -> None:
+        if format not in ("jsonl", "chrome"):
+            raise ValueError(f"Unknown trace format: {format}")
+        with self.lock:
+            self.enabled = enabled
+            self.output_file = output_file
+            self.format = format
+            if output_file and format == "jsonl":
+                open(output_file, 'w').close()
+
+    def start_turn(self, **marks: Optional[float]) -> None:
+        """Begin a new turn, marks taken before it started can be passed in."""
+        with self.lock:
+            if not self.enabled:
+                return
+            self.turn = {name: value for name, value in marks.items() if value is not None}
+            self.turn_info = {"wall_time": time.time()}
+
+    def mark(self, name: str, timestamp: Optional[float] = None) -> None:
+        """Record the first occurrence of name in the current turn (perf_counter time)."""
+        turn = self.turn
+        if turn is None or name in turn:
+            return
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        with self.lock:
+            if self.turn is turn:
+                turn.setdefault(name, timestamp)
+
+    def set_info(self, **info) -> None:
+        with self.lock:
+            if self.turn is not None:
+                self.turn_info.update(info)
+
+    def end_turn(self, **info) -> Optional[Dict]:
+        """Close the current turn and write its record."""
+        with self.lock:
+            if self.turn is None:
+                return None
+            turn, self.turn = self.turn, None
+            self.turn_info.update(info)
+
+            origin = min(turn.values()) if turn else time.perf_counter()
+            record = {
+                "turn": len(self.turns) + 1,
+                **self.turn_info,
+                "start": origin - self.session_start,
+                # milliseconds since the earliest mark, usually speech_end
+                "marks": {name: round((turn[name] - origin) * 1000.0, 2)
+                          for name in TURN_MARKS if name in turn},
+            }
+            self.turns.append(record)
+            self._write(record)
+            return record
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95 of every mark over the session, in milliseconds."""
+        with self.lock:
+            turns = list(self.turns)
+        result = {}
+        for name in TURN_MARKS:
+            values = [turn["marks"][name] for turn in turns if name in turn["marks"]]
+            if values:
+                result[name] = {
+                    "count": len(values),
+                    "p50": round(percentile(values, 50), 2),
+                    "p95": round(percentile(values, 95), 2),
+                }
+        return result
+
+    def format_summary(self) -> str:
+        lines = [f"{'mark':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}"]
+        for name, stats in self.summary().items():
+            lines.append(f"{name:<24}{stats['count']:>7}{stats['p50']:>10.1f}{stats['p95']:>10.1f}")
+        return '\n'.join(lines)
+
+    def chrome_trace(self) -> Dict:
+        """All turns of the session as Chrome trace events."""
+        events = []
+        for turn in self.turns:
+            base = turn["start"] * 1e6
+            marks = sorted(turn["marks"].items(), key=lambda item: item[1])
+            if not marks:
+                continue
+            events.append({
+                "name": f"turn {turn['turn']}", "ph": "X", "pid": 1, "tid": 1,
+                "ts": base, "dur": marks[-1][1] * 1000.0,
+                "args": {key: value for key, value in turn.items() if key != "marks"},
+            })
+            # one slice per phase between two consecutive marks
+            for (name, start), (next_name, end) in zip(marks, marks[1:]):
+                events.append({
+                    "name": f"{name} -> {next_name}", "ph": "X", "pid": 1, "tid": 2,
+                    "ts": base + start * 1000.0, "dur": (end - start) * 1000.0,
+                })
+            for name, offset in marks:
+                events.append({
+                    "name": name, "ph": "i", "s": "t", "pid": 1, "tid": 1,
+                    "ts": base + offset * 1000.0,
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def _write(self, record: Dict) -> None:
+        # caller holds lock
+        if not self.output_file:
+            return
+        if self.format == "jsonl":
+            with open(self.output_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        else:
+            # rewritten after every turn so a crash keeps the session so far
+            with open(self.output_file, 'w') as f:
+                json.dump(self.chrome_trace(), f)
+
+
+tracer = TurnTracer()
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ModelWarmer:
+    """
+    Keeps a local model loaded and the prompt prefix in its KV cache.
+
+    start() warms up in a background thread right away, so the model load
+    and the system prompt prefill happen while the assistant starts up
+    instead of in the first turn. After that the current prompt is
+    prefilled again whenever the assistant was idle for refresh_interval
+    seconds, before the server's keep-alive unloads the model or other
+    requests push the prefix out of the cache. Turns call suspend() and
+    resume(), no refresh is sent while a turn runs.
+    """
+    def __init__(
+            self,
+            llm_handler,
+            get_system_prompt: Callable[[], str],
+            refresh_interval: float = 240.0):
+
+        self.llm_handler = llm_handler
+        self.get_system_prompt = get_system_prompt
+        self.refresh_interval = refresh_interval
+
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.suspended = False
+        self.stopping = False
+        self.next_time = 0.0
+        self.attempts = 0
+
+        self.stats = {
+            "warmups": 0,
+            "failed": 0,
+            "first_duration": 0.0,
+            "last_duration": 0.0,
+        }
+
+    def start(self) -> None:
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.next_time = time.monotonic()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def suspend(self) -> None:
+        """A turn starts, hold back refreshes. A running warm-up finishes."""
+        with self.condition:
+            self.suspended = True
+
+    def resume(self) -> None:
+        """The turn is over, the idle time until the next refresh starts now."""
+        with self.condition:
+            self.suspended = False
+            self.next_time = time.monotonic() + self.refresh_interval
+            self.condition.notify_all()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _wait_for_refresh(self) -> bool:
+        with self.condition:
+            while not self.stopping:
+                if self.suspended or (self.attempts and self.refresh_interval <= 0):
+                    timeout = None
+                else:
+                    timeout = self.next_time - time.monotonic()
+                    if timeout <= 0:
+                        return True
+                self.condition.wait(timeout)
+            return False
+
+    def _run(self) -> None:
+        while self._wait_for_refresh():
+            start_time = time.time()
+            try:
+                warmed = self.llm_handler.warm_up(self.get_system_prompt())
+            except Exception as e:
+                logger.warning(f"Warm-up failed: {e}")
+                warmed = False
+            duration = time.time() - start_time
+
+            if warmed is None:
+                return  # a hosted model, nothing to keep loaded
+            with self.condition:
+                self.attempts += 1
+                if warmed:
+                    if not self.stats["warmups"]:
+                        self.stats["first_duration"] = duration
+                    self.stats["warmups"] += 1
+                    self.stats["last_duration"] = duration
+                    logger.debug(f"Model warm-up took {duration:.2f} seconds")
+                else:
+                    self.stats["failed"] += 1
+                self.next_time = time.monotonic() + self.refresh_interval
@@ -1,37 +1,27 @@
-import json
 import os
-import time
-from typing import Callable, Dict, Any, List
+from typing import Dict, Any, Iterator
+import httpx
 from anthropic import Anthropic
-from lib.conversation import Conversation
+from lib.llmhandler import BaseLLMHandler
+
+class LLMHandler(BaseLLMHandler):
+    default_tokenizer = "estimate:claude"
 
-class LLMHandler:
     def __init__(
             self,
             completion_params_file: str = "llm_anthropic/completion_params.json",
             max_tokens: int = 1000,
-            log_stats: bool = False):
+            log_stats: bool = False,
+            connect_timeout: float = 3.0,
+            read_timeout: float = 60.0):
 
-        self.completion_params = self.load_completion_params(completion_params_file)
-        self.max_tokens = max_tokens
-        self.conversation = Conversation(max_tokens)
-        self.log_stats = log_stats
+        super().__init__(completion_params_file, max_tokens, log_stats)
         
-        # Initialize Anthropic client
+        # Initialize Anthropic client, it keeps a pooled keep-alive connection
         api_key = os.environ.get("ANTHROPIC_API_KEY")
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
-        self.client = Anthropic(api_key=api_key)
-
-    def load_completion_params(self, file_path: str) -> Dict[str, Any]:
-        with open(file_path, 'r') as f:
-            return json.load(f)
-
-    def add_user_text(self, text: str):
-        self.conversation.add_user_message(text)
-
-    def add_assistant_text(self, text: str):
-        self.conversation.add_assistant_message(text)
+        self.client = Anthropic(api_key=api_key, timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
 
     def create_messages(self, system_prompt: str) -> Dict[str, Any]:
         messages = []
@@ -40,56 +30,24 @@ class LLMHandler:
                 messages.append({"role": role, "content": message})
         
         return {
-            "system": system_prompt,
+            # cache the system prompt, it is the same on every turn
+            "system": [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}],
             "messages": messages
         }
 
-    def generate_response(
-            self,
-            system_prompt: str,
-            on_token: Callable[[str], None] = None):
-
-        message_data = self.create_messages(system_prompt)
-        
-        payload = {
+    def build_payload(self, system_prompt: str) -> Dict[str, Any]:
+        return {
             "model": self.completion_params["model"],
             "max_tokens": self.max_tokens,
-            **message_data,
+            **self.create_messages(system_prompt),
             **self.completion_params.get("parameters", {})
         }
 
-        start_time = time.time()
-        collected_messages = []
+    def stream_tokens(self, payload: Dict[str, Any]) -> Iterator[str]:
+        with self.client.messages.stream(**payload) as stream:
+            self.active_response = stream
+            for text in stream.text_stream:
+                yield text
 
-        try:
-            with self.client.messages.stream(**payload) as stream:
-                for text in stream.text_stream:
-                    collected_messages.append(text)
-                    if on_token:
-                        on_token(text)
-                    
-                    if self.log_stats:
-                        chunk_time = time.time() - start_time
-                        print(f"Token received {chunk_time:.2f} seconds after request: {text}")
-
-            full_response = ''.join(collected_messages)
-            self.add_assistant_text(full_response)
-
-            if self.log_stats:
-                total_time = time.time() - start_time
-                print(f"Full response received {total_time:.2f} seconds after request")
-                print(f"Full response: {full_response}")
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-    def write_payload(self, file_path: str = 'payload.txt', mode='w'):
-        message_data = self.create_messages("You are a helpful assistant.")
-        payload = {
-            "model": self.completion_params["model"],
-            "max_tokens": self.max_tokens,
-            **message_data,
-            **self.completion_params.get("parameters", {})
-        }
-        with open(file_path, mode) as f:
-            json.dump(payload, f, indent=4)
\ No newline at end of file
+    def close(self):
+        self.client.close()
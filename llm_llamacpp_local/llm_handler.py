@@ -0,0 +1,189 @@
+import codecs
+import functools
+import os
+import pickle
+import threading
+from typing import Dict, Any, Iterator, List
+from llama_cpp import Llama
+from lib.llmhandler import BaseLLMHandler
+
+SESSION_VERSION = 1
+
+class LLMHandler(BaseLLMHandler):
+    """
+    In-process llama.cpp backend: loads the GGUF model with llama-cpp-python
+    instead of talking to the llama.cpp server.
+
+    The KV cache stays in memory between turns. The prompt is built from
+    per-message token lists, and llama.cpp only evaluates the part after
+    the longest prefix it already holds, usually just the new user turn.
+    close() saves the KV state together with the history to session_file,
+    a restarted process restores both and continues without a prefill.
+
+    With shared_model the handler uses the model of another handler instead
+    of loading its own, requests of both are serialized by its model_lock.
+    """
+    handler_params = BaseLLMHandler.handler_params + (
+        "model_path", "n_ctx", "n_threads", "n_gpu_layers", "use_mlock", "session_file")
+
+    def __init__(
+            self,
+            completion_params_file: str = "llm_llamacpp_local/completion_params.json",
+            max_tokens: int = 1548,
+            log_stats: bool = False,
+            shared_model: "LLMHandler" = None):
+
+        super().__init__(completion_params_file, max_tokens, log_stats)
+        params = self.completion_params
+        self.model_path = params["model_path"]
+        if shared_model is not None:
+            self.llm = shared_model.llm
+            self.model_lock = shared_model.model_lock
+            self.session_file = None  # the session belongs to the owner
+        else:
+            self.llm = Llama(
+                model_path=self.model_path,
+                n_ctx=params.get("n_ctx", 2048),
+                n_threads=params.get("n_threads"),
+                n_gpu_layers=params.get("n_gpu_layers", 0),
+                use_mlock=params.get("use_mlock", False),  # pin the weights in RAM
+                verbose=False)
+            self.model_lock = threading.Lock()
+            self.session_file = params.get("session_file")
+
+        # count with the model's own tokenizer
+        self.conversation.set_token_counter(self.count_model_tokens)
+        self.tokenize_text = functools.lru_cache(maxsize=1024)(self._tokenize_text)
+        self.im_end_token = self.tokenize_text("<|im_end|>")[-1]
+        self.prompt_tokens: List[int] = []
+        self.kv_stats = {
+            "prompt_tokens": 0,
+            "reused_tokens": 0,
+            "evaluated_tokens": 0,
+        }
+
+        self.load_session()
+
+    def _tokenize_text(self, text: str) -> List[int]:
+        return self.llm.tokenize(text.encode('utf-8'), add_bos=False, special=True)
+
+    def count_model_tokens(self, text: str) -> int:
+        return len(self.tokenize_text(text))
+
+    def create_prompt_tokens(self, system_prompt: str) -> List[int]:
+        # same ChatML layout as the llama.cpp server handler, tokenized per
+        # message so the tokens of earlier turns never change
+        tokens = [self.llm.token_bos()]
+        tokens += self.tokenize_text(f"<|im_start|>system\n{system_prompt}<|im_end|>\n")
+        for role, message in self.conversation.get_history():
+            tokens += self.tokenize_text(f"<|im_start|>{role}\n{message}<|im_end|>\n")
+        tokens += self.tokenize_text("<|im_start|>assistant")
+        return tokens
+
+    def build_payload(self, system_prompt: str) -> Dict[str, Any]:
+        self.prompt_tokens = self.create_prompt_tokens(system_prompt)
+        return {
+            "prompt_tokens": len(self.prompt_tokens),
+            **self.completion_params.get("parameters", {})
+        }
+
+    def stream_tokens(self, payload: Dict[str, Any]) -> Iterator[str]:
+        params = self.completion_params.get("parameters", {})
+        max_new_tokens = params.get("max_tokens", 500)
+        stops = params.get("stop", [])
+        tokens = self.prompt_tokens
+
+        with self.model_lock:
+            cached = self.llm.input_ids[:self.llm.n_tokens]
+            reused = 0
+            for reused, (cached_token, token) in enumerate(zip(cached, tokens)):
+                if cached_token != token:
+                    break
+            else:
+                reused = min(len(cached), len(tokens))
+            self.kv_stats["prompt_tokens"] = len(tokens)
+            self.kv_stats["reused_tokens"] = reused
+            self.kv_stats["evaluated_tokens"] = len(tokens) - reused
+            if self.log_stats:
+                print(f"KV cache: {reused}/{len(tokens)} prompt tokens reused")
+
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+            text = ""
+            generator = self.llm.generate(
+                tokens,
+                temp=params.get("temperature", 0.7),
+                top_p=params.get("top_p", 0.9),
+                top_k=params.get("top_k", 40),
+                repeat_penalty=params.get("repeat_penalty", 1.1),
+                reset=True)  # with reset llama.cpp keeps the longest matching prefix
+            try:
+                for count, token in enumerate(generator):
+                    if token in (self.llm.token_eos(), self.im_end_token) or count >= max_new_tokens:
+                        break
+                    piece = decoder.decode(self.llm.detokenize([token]))
+                    text += piece
+                    stop_pos = min((text.find(stop) for stop in stops if stop in text), default=-1)
+                    if stop_pos >= 0:
+                        piece = piece[:max(0, len(piece) - (len(text) - stop_pos))]
+                        if piece:
+                            yield piece
+                        break
+                    if piece:
+                        yield piece
+            finally:
+                generator.close()
+
+    def build_warmup_payload(self, system_prompt: str) -> Dict[str, Any]:
+        return {"prompt_tokens": self.create_prompt_tokens(system_prompt)}
+
+    def send_warmup(self, payload: Dict[str, Any]) -> bool:
+        with self.model_lock:
+            generator = self.llm.generate(payload["prompt_tokens"], reset=True)
+            try:
+                # the prompt is evaluated before the first token is sampled
+                next(generator)
+            finally:
+                generator.close()
+        return True
+
+    def save_session(self):
+        if not self.session_file:
+            return
+        with self.model_lock:
+            session = {
+                "version": SESSION_VERSION,
+                "model_path": self.model_path,
+                "history": list(self.conversation.get_history()),
+                "memory": self.conversation.memory,
+                "state": self.llm.save_state(),
+            }
+        temp_file = self.session_file + ".tmp"
+        with open(temp_file, 'wb') as f:
+            pickle.dump(session, f)
+        os.replace(temp_file, self.session_file)
+
+    def load_session(self):
+        if not self.session_file or not os.path.exists(self.session_file):
+            return
+        try:
+            with open(self.session_file, 'rb') as f:
+                session = pickle.load(f)
+        except Exception as e:
+            self.logger.warning(f"Could not read session {self.session_file}: {e}")
+            return
+        if session.get("version") != SESSION_VERSION or session.get("model_path") != self.model_path:
+            self.logger.warning(f"Session {self.session_file} belongs to another model, starting fresh")
+            return
+        self.llm.load_state(session["state"])
+        for role, message in session["history"]:
+            self.conversation.add_message(role, message)
+        if session["memory"]:
+            self.conversation.apply_compaction([], session["memory"])
+        print(f"Resumed session with {len(session['history'])} messages and {self.llm.n_tokens} cached tokens")
+
+    def create_background_handler(self) -> "LLMHandler":
+        # a second handler must not load a second copy of the model
+        return LLMHandler(shared_model=self)
+
+    def close(self):
+        self.save_session()
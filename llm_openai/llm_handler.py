@@ -1,94 +1,45 @@
-import json
 import os
-import time
-from typing import Callable, Dict, Any, List
+from typing import Dict, Any, Iterator
+import httpx
 from openai import OpenAI
-from lib.conversation import Conversation
+from lib.llmhandler import BaseLLMHandler
+
+class LLMHandler(BaseLLMHandler):
+    default_tokenizer = "tiktoken:gpt-4o"
 
-class LLMHandler:
     def __init__(
             self,
             completion_params_file: str = "llm_openai/completion_params.json",
             max_tokens: int = 1548,
-            log_stats: bool = False):
+            log_stats: bool = False,
+            connect_timeout: float = 3.0,
+            read_timeout: float = 60.0):
 
-        self.completion_params = self.load_completion_params(completion_params_file)
-        self.max_tokens = max_tokens
-        self.conversation = Conversation(max_tokens)
-        self.log_stats = log_stats
+        super().__init__(completion_params_file, max_tokens, log_stats)
         
-        # Initialize OpenAI client
+        # Initialize OpenAI client, it keeps a pooled keep-alive connection
         api_key = os.environ.get("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
-        self.client = OpenAI(api_key=api_key)
-
-    def load_completion_params(self, file_path: str) -> Dict[str, Any]:
-        with open(file_path, 'r') as f:
-            return json.load(f)
-
-    def add_user_text(self, text: str):
-        self.conversation.add_user_message(text)
-
-    def add_assistant_text(self, text: str):
-        self.conversation.add_assistant_message(text)
-
-    def create_messages(self, system_prompt: str) -> List[Dict[str, str]]:
-        messages = [{"role": "system", "content": system_prompt}]
-        for role, message in self.conversation.get_history():
-            messages.append({"role": role, "content": message})
-        return messages
-
-    def generate_response(
-            self,
-            system_prompt: str,
-            on_token: Callable[[str], None] = None):
+        self.client = OpenAI(api_key=api_key, timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
 
-        messages = self.create_messages(system_prompt)
-        
-        payload = {
+    def build_payload(self, system_prompt: str) -> Dict[str, Any]:
+        return {
             "model": self.completion_params["model"],
-            "messages": messages,
+            "messages": self.create_messages(system_prompt),
             "stream": True,
             **self.completion_params.get("parameters", {})
         }
 
-        start_time = time.time()
-        collected_messages = []
+    def stream_tokens(self, payload: Dict[str, Any]) -> Iterator[str]:
+        response = self.client.chat.completions.create(**payload)
+        self.active_response = response
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                yield chunk.choices[0].delta.content
 
-        try:
-            response = self.client.chat.completions.create(**payload)
-            
-            for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    token = chunk.choices[0].delta.content
-                    collected_messages.append(token)
-                    if on_token:
-                        on_token(token)
-                    
-                    if self.log_stats:
-                        chunk_time = time.time() - start_time
-                        print(f"Token received {chunk_time:.2f} seconds after request: {token}")
-
-            full_response = ''.join(collected_messages)
-
-            if self.log_stats:
-                total_time = time.time() - start_time
-                print(f"Full response received {total_time:.2f} seconds after request")
-                print(f"Full response: {full_response}")
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-    def write_payload(self, file_path: str = 'payload.txt', mode='w'):
-        payload = {
-            "model": self.completion_params["model"],
-            "messages": self.create_messages("You are a helpful assistant."),
-            "stream": True,
-            **self.completion_params.get("parameters", {})
-        }
-        with open(file_path, mode) as f:
-            json.dump(payload, f, indent=4)
+    def close(self):
+        self.client.close()
 
             
 # import json
@@ -1,16 +1,23 @@
 import os
-import re
-import time
 import json
+import threading
+import time
 from typing import List
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from tts_handler import TTSHandler
+from lib.textstream import EmotionTextStream
+from lib.speculation import SpeculativeResponder
+from lib.compaction import HistoryCompactor
+from lib.warmup import ModelWarmer
+from lib.hedgedllm import HedgedLLMHandler
+from lib.earlystop import EarlyStopController
+from lib.turntrace import tracer
 from RealtimeSTT import AudioToTextRecorder
 import logging
 
 @dataclass
 class Config:
-    llm_provider: str = "lmstudio"  # "llamacpp" or "ollama" or "openai" or "anthropic" or "lmstudio"
+    llm_provider: str = "lmstudio"  # "llamacpp" or "llamacpp_local" or "ollama" or "openai" or "anthropic" or "lmstudio"
     print_emotions: bool = True
     print_llm_text: bool = True
     use_tts: bool = True
@@ -22,16 +29,48 @@ class Config:
     stt_silence_duration: float = 0.15
     chat_params_file: str = "chat_params.json"    
     tts_config_file: str = "tts_config.json"
+    barge_in: bool = False  # user speech interrupts the reply, needs a headset or echo cancellation
+    speculative_llm: bool = False  # start the LLM request on stable partial transcripts
+    trace_file: str = ""  # per-turn latency records, e.g. "turn_trace.jsonl"
+    trace_format: str = "jsonl"  # "jsonl" or "chrome" (chrome://tracing, ui.perfetto.dev)
+    compaction: bool = False  # summarize old turns into a memory block instead of dropping them
+    compact_at_tokens: int = 1200  # compact once the prompt grows beyond this
+    compact_keep_tokens: int = 500  # recent history kept verbatim
+    memory_max_tokens: int = 250
+    warmup: bool = True  # load the local model and prefill the system prompt at startup
+    warmup_refresh: float = 240.0  # idle seconds before the prompt is prefilled again, 0 = only at startup
+    llm_hedge_providers: List[str] = field(default_factory=list)  # e.g. ["openai"], tried after llm_provider when it stalls or fails
+    hedge_deadline: float = 1.5  # seconds without a first token before the next provider is asked, adapts to the measured p95
+    early_stop: str = "on"  # "on", "observe" (only count the tokens it would save) or "off"
+    early_stop_max_pairs: int = 4  # stop the LLM after this many emotion-sentence pairs, see chat_params.json
 
 
 def color_text(text, color_code):
     return f"\033[{color_code}m{text}\033[0m"
 
+def load_llm_handler_class(llm_provider: str):
+    if llm_provider == "llamacpp":
+        from llm_llamacpp.llm_handler import LLMHandler
+    elif llm_provider == "llamacpp_local":
+        from llm_llamacpp_local.llm_handler import LLMHandler
+    elif llm_provider == "ollama":
+        from llm_ollama.llm_handler import LLMHandler
+    elif llm_provider == "openai":
+        from llm_openai.llm_handler import LLMHandler
+    elif llm_provider == "anthropic":
+        from llm_anthropic.llm_handler import LLMHandler
+    elif llm_provider == "lmstudio":
+        from llm_lmstudio.llm_handler import LLMHandler
+    else:
+        raise ValueError(f"Unknown LLM provider: {llm_provider}")
+    return LLMHandler
+
 class Main:
     def __init__(self, config: Config):
         self.config = config
         self.setup_logging()
         self.valid_emotions = self.get_valid_emotions()
+        tracer.configure(config.trace_file, config.trace_format)
 
         # Load chat parameters
         with open(config.chat_params_file, 'r') as f:
@@ -42,31 +81,63 @@ class Main:
             model=config.stt_model,
             language=config.stt_language,
             spinner=False,
-            post_speech_silence_duration=config.stt_silence_duration
+            post_speech_silence_duration=config.stt_silence_duration,
+            on_recording_start=self.on_user_speech_start,
+            on_recording_stop=self.on_user_speech_end,
+            enable_realtime_transcription=config.speculative_llm,
+            on_realtime_transcription_stabilized=self.on_partial_transcript
         )
-        self.llm_handler = None
-        if config.llm_provider == "llamacpp":
-            from llm_llamacpp.llm_handler import LLMHandler
-        elif config.llm_provider == "ollama":
-            from llm_ollama.llm_handler import LLMHandler
-        elif config.llm_provider == "openai":
-            from llm_openai.llm_handler import LLMHandler
-        elif config.llm_provider == "anthropic":
-            from llm_anthropic.llm_handler import LLMHandler
-        elif config.llm_provider == "lmstudio":
-            from llm_lmstudio.llm_handler import LLMHandler
+        LLMHandler = load_llm_handler_class(config.llm_provider)
         self.llm_handler = LLMHandler()
-
+        primary_handler = self.llm_handler
+        if config.llm_hedge_providers:
+            providers = [config.llm_provider] + list(config.llm_hedge_providers)
+            handlers = [self.llm_handler] + [load_llm_handler_class(provider)() for provider in config.llm_hedge_providers]
+            self.llm_handler = HedgedLLMHandler(handlers, providers, hedge_deadline=config.hedge_deadline)
+
+        self.compactor = None
+        if config.compaction:
+            # a second handler of the same provider, so the summary request
+            # never shares stream or cancel state with a turn
+            self.compactor = HistoryCompactor(
+                self.llm_handler,
+                primary_handler.create_background_handler(),
+                compact_at_tokens=config.compact_at_tokens,
+                keep_tokens=config.compact_keep_tokens,
+                memory_max_tokens=config.memory_max_tokens)
+
+        self.warmer = None
+        if config.warmup:
+            # runs while STT and TTS load, the first turn finds the model hot
+            self.warmer = ModelWarmer(self.llm_handler, self.get_system_prompt, config.warmup_refresh)
+            self.warmer.start()
 
         self.tts_handler = TTSHandler(config.tts_config_file) if config.use_tts else None        
+        if self.tts_handler:
+            self.tts_handler.start()
         
         # Token processing state
-        self.plain_text = ""
-        self.last_plain_text = ""
-        self.buffer = ""
-        self.in_emotion = False
-        self.last_char = ""
-        self.assistant_text = ""  # New variable to store complete assistant response
+        self.text_stream = EmotionTextStream()
+        self.early_stop = None
+        if config.early_stop != "off":
+            self.early_stop = EarlyStopController(
+                config.early_stop_max_pairs,
+                stop=config.early_stop == "on",
+                count_tokens=self.llm_handler.conversation.count_tokens_func)
+
+        # Barge-in state
+        self.turn_lock = threading.Lock()
+        self.turn_active = False
+        self.turn_interrupted = False
+        self.spoken_text = ""
+        self.listener_thread = None
+        self.listener_text = ""
+
+        self.speculator = None
+
+        # Turn trace timestamps taken before the turn starts
+        self.speech_end_time = None
+        self.transcript_time = None
 
     def setup_logging(self):
         level = logging.DEBUG if self.config.dbg_log else self.config.log_level_nondebug
@@ -117,45 +188,34 @@ class Main:
         return system_prompt
 
     def process_llm_token(self, token: str):
-        for char in token:
-            self.assistant_text += char  # Add each character to the complete assistant text
-            # if char == ' ' and self.last_char == ']':
-            #     continue
-            if char == '[':
-                if self.buffer:
-                    self.process_buffer()
-                self.buffer = '['
-                self.in_emotion = True
-            elif char == ']' and self.in_emotion:
-                self.buffer += ']'
-                self.process_emotion()
-                self.buffer = ""
-                self.in_emotion = False
+        self.process_stream_events(self.text_stream.feed(token))
+
+    def process_stream_events(self, events):
+        if self.early_stop:
+            stopped = self.early_stop.stopped
+            events = self.early_stop.filter(events)
+            if self.early_stop.stop and self.early_stop.stopped and not stopped:
+                # the reply has all its pairs, don't let the model run on
+                self.llm_handler.cancel()
+        for text, emotion in events:
+            if emotion is not None:
+                self.process_emotion(emotion)
             else:
-                self.buffer += char
-                if not self.in_emotion and self.buffer:
-                    self.process_buffer()
-            self.last_char = char
+                self.process_plain_text(text)
 
-    def process_buffer(self):
-        new_text = self.process_plain_text(self.buffer)
-        if self.tts_handler:
-            self.tts_handler.sentence_queue.add_text(new_text)
-        self.buffer = ""
-
-    def process_plain_text(self, text: str) -> str:
-        self.plain_text += text
-        self.plain_text = re.sub(r'\n', '', self.plain_text)    # Remove all linebreaks
-        self.plain_text = re.sub(r'^\s+', '', self.plain_text)
-        self.plain_text = re.sub(r'\s+', ' ', self.plain_text)  # Replace multiple whitespaces with a single space
-        new_text = self.plain_text[len(self.last_plain_text):]
-        self.last_plain_text = self.plain_text
+    def process_plain_text(self, text: str):
+        if self.turn_interrupted:
+            return
         if self.config.print_llm_text:
-            print(f"\033[96m{new_text}\033[0m", end='', flush=True)
-        return new_text
+            print(f"\033[96m{text}\033[0m", end='', flush=True)
+        if self.tts_handler:
+            if self.tts_handler.sentence_queue.add_text(text):
+                tracer.mark("first_sentence_queued")
 
-    def process_emotion(self):
-        emotion = self.buffer[1:-1].lower()
+    def process_emotion(self, emotion: str):
+        if self.turn_interrupted:
+            return
+        tracer.mark("first_emotion")
         current_emotion = "neutral" if emotion not in self.valid_emotions else emotion
         if self.config.print_emotions:
             print(f"(\033[0;91m{current_emotion.lower()}\033[0m) ", end='', flush=True)
@@ -167,6 +227,8 @@ class Main:
         self.print_character_info()
         #self.print_scenario()
         system_prompt = self.get_system_prompt()
+        if self.config.speculative_llm:
+            self.speculator = SpeculativeResponder(self.llm_handler, system_prompt)
 
         while True:
             user_text = self.get_user_input()
@@ -182,79 +244,163 @@ class Main:
 
         print(f"\n>>> {user_name}: ", end="", flush=True)
 
+        if self.speculator:
+            self.speculator.resume()
+
         user_text = ""
         while len(user_text.strip()) == 0:
-            user_text = self.recorder.text()
+            if self.listener_thread is not None:
+                # the recorder has been listening since the reply started
+                self.listener_thread.join()
+                self.listener_thread = None
+                user_text = self.listener_text
+            else:
+                user_text = self.recorder.text()
+        self.transcript_time = time.perf_counter()
         colored_user_text = color_text(user_text, '93')
         print(colored_user_text)
         return user_text
 
+    def start_listening(self):
+        if self.listener_thread is None:
+            self.listener_text = ""
+            self.listener_thread = threading.Thread(target=self.listen_worker, daemon=True)
+            self.listener_thread.start()
+
+    def listen_worker(self):
+        self.listener_text = self.recorder.text()
+
+    def on_user_speech_end(self):
+        self.speech_end_time = time.perf_counter()
+
+    def on_partial_transcript(self, text: str):
+        if self.speculator and not self.turn_active:
+            self.speculator.update(text)
+
+    def on_user_speech_start(self):
+        if not self.config.barge_in:
+            return
+        with self.turn_lock:
+            if not self.turn_active or self.turn_interrupted:
+                return
+            self.turn_interrupted = True
+
+        # stop generating and speaking, keep what the user actually heard
+        self.llm_handler.cancel()
+        if self.tts_handler:
+            self.spoken_text = self.tts_handler.interrupt()
+        else:
+            self.spoken_text = self.text_stream.raw_text()
+        logging.debug(f"Reply interrupted, spoken so far: {self.spoken_text}")
+
     def should_exit(self, user_text: str) -> bool:
         return len(user_text) <= 7 and "exit" in user_text.lower()
 
     def process_user_input(self, user_text: str, system_prompt: str):
         char_name = color_text(self.chat_params['char'], '96')  # Light Magenta
         print(f"<<< {char_name}: ", end="", flush=True)
-        self.llm_handler.add_user_text(user_text)
+
+        tracer.start_turn(speech_end=self.speech_end_time, transcript_ready=self.transcript_time)
+        self.speech_end_time = None
+
+        if self.warmer:
+            self.warmer.suspend()
+            tracer.set_info(warmups=self.warmer.stats["warmups"])
+
+        if self.compactor:
+            # the turn needs the model now, compaction is retried afterwards
+            self.compactor.cancel()
+            tracer.set_info(**self.compactor.get_turn_stats())
+
+        # a speculative request on the same transcript is already running
+        speculative = self.speculator is not None and self.speculator.commit(user_text)
+        if not speculative:
+            self.llm_handler.add_user_text(user_text)
+        tracer.set_info(speculative=speculative)
 
         # Reset token processing state
-        self.plain_text = ""
-        self.last_plain_text = ""
-        self.buffer = ""
-        self.in_emotion = False
-        self.last_char = ""
-        self.assistant_text = ""
+        self.text_stream.reset()
+        if self.early_stop:
+            self.early_stop.reset()
 
         if self.tts_handler:
-            self.tts_handler.initialize_pyaudio()
-            self.tts_handler.start_threads()
-
-        self.llm_handler.generate_response(system_prompt, on_token=self.process_llm_token)
+            self.tts_handler.begin_turn()
+        if not speculative:
+            # before the turn is active, a barge-in from here on cancels the request
+            self.llm_handler.begin_turn()
+
+        with self.turn_lock:
+            self.turn_active = True
+            self.turn_interrupted = False
+            self.spoken_text = ""
+        if self.config.barge_in:
+            self.start_listening()
+
+        if speculative:
+            self.speculator.attach(self.process_llm_token)
+        else:
+            self.llm_handler.generate_response(system_prompt, on_token=self.process_llm_token)
         
         # Process any remaining buffer content
-        if self.buffer:
-            self.process_buffer()
+        self.process_stream_events(self.text_stream.flush())
 
-        # Add the complete assistant text to the LLM handler's history
-        self.llm_handler.add_assistant_text(self.assistant_text)
-
-        if self.tts_handler:
-            self.tts_handler.sentence_queue.finish_current_sentence()
+        if self.tts_handler and not self.turn_interrupted:
+            self.tts_handler.finish_turn()
         self.llm_handler.write_payload()
 
         self.wait_for_tts_completion()
 
+        with self.turn_lock:
+            self.turn_active = False
+        if self.early_stop:
+            tracer.set_info(**self.early_stop.turn_stats())
+        tracer.end_turn(interrupted=self.turn_interrupted)
+
+        # Add the assistant text to the LLM handler's history, after a
+        # barge-in only the part the user actually heard
+        if self.turn_interrupted:
+            print(color_text(" [interrupted]", '90'))
+            self.llm_handler.add_assistant_text(self.spoken_text or "...")
+        elif self.early_stop and self.early_stop.stop and self.early_stop.stopped:
+            self.llm_handler.add_assistant_text(self.early_stop.text())
+        else:
+            self.llm_handler.add_assistant_text(self.text_stream.raw_text())
+
+        if self.compactor:
+            # idle until the user speaks, summarize old turns in the background
+            self.compactor.start(system_prompt)
+        if self.warmer:
+            self.warmer.resume()
+
     def wait_for_tts_completion(self):
         if not self.tts_handler:
             return
 
         logging.debug("Waiting for TTS to finish processing...")
-        not_playing_start_time = None
-        while True:
-            if self.tts_handler.sentence_queue.is_empty():
-                finished_playout = (
-                    not self.tts_handler.stream.is_playing() and
-                    self.tts_handler.sentence_queue.is_empty() and
-                    self.tts_handler.chunk_queue.empty()
-                )
-                if finished_playout:
-                    if not_playing_start_time is None:
-                        not_playing_start_time = time.time()
-                    if time.time() - not_playing_start_time >= 0.5:
-                        break
-                else:
-                    not_playing_start_time = None
-            time.sleep(0.01)
-
+        self.tts_handler.wait_for_playback()
         logging.debug("All sentences processed and TTS playback completed.")
-        self.tts_handler.stop_event.set()
-        self.tts_handler.tts_sentence_thread.join()
-        self.tts_handler.shutdown_pyaudio()
 
     def cleanup(self):
+        if self.compactor:
+            self.compactor.cancel()
+            logging.debug(f"Compaction stats: {self.compactor.stats}")
+        if self.speculator:
+            self.speculator.cancel()
+            logging.debug(f"Speculation stats: {self.speculator.stats}")
+        if self.early_stop:
+            logging.debug(f"Early stop stats: {self.early_stop.stats}")
+        if isinstance(self.llm_handler, HedgedLLMHandler):
+            logging.debug(f"Hedging stats: {self.llm_handler.stats}")
+            logging.debug(f"Time to first token per provider: {self.llm_handler.latency_summary()}")
+        if self.warmer:
+            self.warmer.stop()
+            logging.debug(f"Warm-up stats: {self.warmer.stats}")
+        self.llm_handler.close()
+        if tracer.turns and (self.config.trace_file or self.config.dbg_log):
+            print(f"\nTurn latency over {len(tracer.turns)} turns:\n{tracer.format_summary()}")
         if self.tts_handler:
             logging.debug("Shutting down TTS engine...")
-            self.tts_handler.engine.shutdown()
+            self.tts_handler.shutdown()
             logging.debug("TTS shutdown complete.")
 
 if __name__ == '__main__':
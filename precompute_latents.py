@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from lib.emotionlatents import (
+    EmotionLatents,
+    EmotionLatentCache,
+    file_hash,
+    load_latent_index,
+    save_latent_archive,
+)
+
+# Scans the references folder from tts_config.json, computes speaker latents
+# for new or changed emotion wavs in worker processes and writes the .json
+# files the coqui engine reads. The packed latent archive (latents.npy and
+# latents_index.json, generated, not checked in) remembers the wav hashes so
+# unchanged voices are skipped on the next run.
+#
+#   python precompute_latents.py [--workers 2] [--force]
+
+_model = None
+
+
+def get_checkpoint_path(tts_config: dict) -> str:
+    if tts_config['use_local_model']:
+        return os.path.join(tts_config['local_models_path'], tts_config['specific_model'])
+    from TTS.utils.generic_utils import get_user_data_dir
+    return os.path.join(get_user_data_dir("tts"), "tts_models--multilingual--multi-dataset--xtts_v2")
+
+
+def init_worker(checkpoint: str, device: str):
+    global _model
+    import torch
+    from TTS.config import load_config
+    from TTS.tts.models import setup_model as setup_tts_model
+
+    config = load_config(os.path.join(checkpoint, "config.json"))
+    _model = setup_tts_model(config)
+    _model.load_checkpoint(config, checkpoint_dir=checkpoint, eval=True)
+    if device == "cuda" and not torch.cuda.is_available():
+        device = "cpu"
+    _model.to(torch.device(device))
+
+
+def compute_latents(emotion: str, wav_path: str):
+    # same conditioning parameters the coqui engine uses
+    gpt_cond_latent, speaker_embedding = _model.get_conditioning_latents(
+        audio_path=wav_path, gpt_cond_len=30, max_ref_length=60)
+    return (
+        emotion,
+        gpt_cond_latent.cpu().squeeze().half().numpy(),
+        speaker_embedding.cpu().squeeze().half().numpy(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute emotion voice latents")
+    parser.add_argument("--tts_config_file", default="tts_config.json")
+    parser.add_argument("--workers", type=int, default=2, help="number of model worker processes")
+    parser.add_argument("--device", default="cuda", help="cuda or cpu")
+    parser.add_argument("--force", action="store_true", help="recompute all voices")
+    args = parser.parse_args()
+
+    with open(args.tts_config_file, 'r') as f:
+        tts_config = json.load(f)
+    references_folder = tts_config['references_folder']
+
+    start_time = time.time()
+    index = {} if args.force else load_latent_index(references_folder)
+    cache = EmotionLatentCache(references_folder)
+    cache.load(with_latents=True)
+
+    hashes = {}
+    entries = {}
+
+    def detach(latents):
+        # copy out of the memory map so the archive file can be replaced
+        return EmotionLatents(latents.emotion, latents.reference,
+                              np.array(latents.gpt_cond_latent), np.array(latents.speaker_embedding))
+
+    to_compute = []
+    for file in sorted(os.listdir(references_folder)):
+        emotion, extension = os.path.splitext(file)
+        if extension != ".wav":
+            continue
+        wav_path = os.path.join(references_folder, file)
+        hashes[emotion] = file_hash(wav_path)
+        latents = cache.entries.get(emotion)
+
+        if emotion in index and index[emotion]["wav_hash"] == hashes[emotion] and latents.has_latents():
+            entries[emotion] = detach(latents)
+        elif not args.force and emotion not in index and latents.has_latents():
+            # latents computed earlier by the engine, import them as they are
+            # (the engine itself trusts an existing .json the same way)
+            print(f"Importing {latents.reference}")
+            entries[emotion] = detach(latents)
+        else:
+            to_compute.append((emotion, wav_path))
+
+    if to_compute:
+        print(f"Computing latents for {len(to_compute)} voices with {args.workers} workers")
+        workers = max(1, min(args.workers, len(to_compute)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(get_checkpoint_path(tts_config), args.device)) as executor:
+            futures = [executor.submit(compute_latents, emotion, wav_path) for emotion, wav_path in to_compute]
+            for future in as_completed(futures):
+                emotion, gpt_cond_latent, speaker_embedding = future.result()
+                json_path = os.path.join(references_folder, emotion + ".json")
+                latents = EmotionLatents(emotion, json_path, gpt_cond_latent, speaker_embedding)
+                with open(json_path, 'w') as f:
+                    json.dump(latents.to_json_dict(), f)
+                entries[emotion] = latents
+                print(f"Computed {emotion}")
+
+    # drop the memory map before replacing the archive file
+    del cache
+    save_latent_archive(references_folder, [entries[emotion] for emotion in sorted(entries)], hashes)
+
+    skipped = len(entries) - len(to_compute)
+    print(f"Wrote {len(entries)} voices ({skipped} unchanged) in {time.time() - start_time:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
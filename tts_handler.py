@@ -1,12 +1,15 @@
 import json
 import threading
-import queue
 import time
-import os
 import pyaudio
 from RealtimeTTS import TextToAudioStream, CoquiEngine
-from lib.sentencequeue import ThreadSafeSentenceQueue, Sentence
+from lib.sentencequeue import ThreadSafeSentenceQueue, Sentence, spoken_text
 from lib.bufferstream import BufferStream
+from lib.segmenter import SentenceSegmenter
+from lib.fragmentsizer import FragmentSizer
+from lib.emotionlatents import EmotionLatentCache
+from lib.audioplayout import AudioPlayout
+from lib.turntrace import tracer
 
 class TTSHandler:
     def __init__(self, config_file='tts_config.json'):
@@ -16,14 +19,62 @@ class TTSHandler:
         self.references_folder = self.config['references_folder']
         self.dbg_log = self.config['dbg_log']
         self.stop_event = threading.Event()
-        self.sentence_queue = ThreadSafeSentenceQueue()
-        self.chunk_queue = queue.Queue()
-        self.chunk_lock = threading.Lock()
+        # split the LLM text once into ready-to-synthesize units here,
+        # instead of letting RealtimeTTS re-split a running sentence
+        self.first_fragment_chars = self.config.get('first_fragment_chars', 10)
+        self.min_sentence_chars = self.config.get('min_sentence_chars', 10)
+        self.segmenter = None
+        if self.config.get('segmenter', True):
+            self.segmenter = SentenceSegmenter(
+                min_chars=self.min_sentence_chars,
+                first_fragment_chars=self.first_fragment_chars,
+                max_chars=self.config.get('max_sentence_chars', 150))
+        self.sentence_queue = ThreadSafeSentenceQueue(self.segmenter)
+        # pick the fragment sizes per turn from the measured synthesis speed
+        self.fragment_sizer = None
+        if self.config.get('adaptive_fragments', True):
+            self.fragment_sizer = FragmentSizer(
+                first_fragment_chars=self.first_fragment_chars,
+                min_chars=self.min_sentence_chars,
+                max_chars=self.config.get('max_sentence_chars', 150))
+        self.synthesis = None  # timing of the unit being synthesized
+        self.playback_finished_event = threading.Event()
+        self.turn_lock = threading.Lock()
+        self.generation = 0
+        self.tts_sentence_thread = None
         
         self.pyFormat = pyaudio.paInt16
         self.pyChannels = 1
         self.pySampleRate = 24000
         self.pyOutput_device_index = None
+        self.playout_buffer_seconds = self.config.get('playout_buffer_seconds', 2.0)
+        self.playout = None
+
+        # look-ahead: synthesize the next sentence while the current one plays
+        self.lookahead = self.config.get('lookahead', True)
+        self.lookahead_seconds = self.config.get('lookahead_seconds', 4.0)
+        # merge LLM tokens into whole words before they reach the TTS stream
+        self.coalesce_window = self.config.get('coalesce_window', 0.02)
+        self.turn_audio_started = False
+        self.turn_segments = []  # (playout byte position, sentence) per sentence
+        self.lookahead_stats = {
+            "handovers": 0,
+            "gaps": 0,
+            "last_slack": 0.0,
+        }
+
+        self.latent_cache = EmotionLatentCache(self.references_folder)
+        self.latent_cache.load()
+        self.active_latents = None
+        self.emotion_stats = {
+            "switches": 0,
+            "skipped": 0,
+            "switch_time_total": 0.0,
+            "last_switch_time": 0.0,
+        }
+        self.turn_emotion_stats = {}
+        if self.dbg_log:
+            print(f"Loaded {len(self.latent_cache)} emotion voices in {self.latent_cache.load_time:.3f}s")
 
         print("Loading TTS")
         if self.config['use_local_model']:
@@ -42,125 +93,300 @@ class TTSHandler:
         self.stream.feed("hi!")  # only small warmup
         self.stream.play(log_synthesized_text=True, muted=True)
 
-    def initialize_pyaudio(self):
-        self.stop_event = threading.Event()
-        self.sentence_queue = ThreadSafeSentenceQueue()
-        self.chunk_queue = queue.Queue()
-
-        self.pyaudio_instance = pyaudio.PyAudio()
-        self.pystream = self.pyaudio_instance.open(
-            format=self.pyFormat,
-            channels=self.pyChannels,
-            rate=self.pySampleRate,
-            output_device_index=self.pyOutput_device_index,
-            output=True)
-        self.pystream.start_stream()
-
-    def tts_play_worker_thread(self):
-        while not self.stop_event.is_set():
-            if self.chunk_queue.empty():
-                time.sleep(0.001)
-                continue
-            with self.chunk_lock:
-                chunk = self.chunk_queue.get()
-            self.pystream.write(chunk)
+    def start(self):
+        """
+        Open the audio device and start the sentence worker once. Both stay
+        alive across turns until shutdown().
+        """
+        if self.playout is None:
+            capacity_seconds = self.playout_buffer_seconds
+            if self.lookahead:
+                # room for the next sentence while the current one drains
+                capacity_seconds += self.lookahead_seconds
+            self.playout = AudioPlayout(
+                sample_rate=self.pySampleRate,
+                channels=self.pyChannels,
+                format=self.pyFormat,
+                capacity_seconds=capacity_seconds,
+                output_device_index=self.pyOutput_device_index)
+            self.playout.open()
+
+        if self.tts_sentence_thread is None:
+            self.tts_sentence_thread = threading.Thread(target=self.tts_sentence_worker_thread)
+            self.tts_sentence_thread.daemon = True
+            self.tts_sentence_thread.start()
+
+    def begin_turn(self) -> int:
+        """
+        Reset the per-turn state and return the new generation token.
+        Audio synthesized for an older generation is discarded.
+        """
+        with self.turn_lock:
+            self.generation += 1
+            self.turn_audio_started = False
+            self.turn_segments = []
+            self.sentence_queue.clear(self.generation)
+            self.playback_finished_event = threading.Event()
+            self.turn_emotion_stats = {
+                "emotion_switches": 0,
+                "emotion_skips": 0,
+                "emotion_switch_time": 0.0,
+            }
+            self.choose_fragment_sizes()
+            return self.generation
+
+    def choose_fragment_sizes(self):
+        """Apply the fragment sizes for the new turn and record them in its trace."""
+        if self.fragment_sizer is None:
+            return
+        decision = self.fragment_sizer.choose()
+        self.first_fragment_chars = decision["first_fragment_chars"]
+        self.min_sentence_chars = decision["min_sentence_chars"]
+        if self.segmenter is not None:
+            with self.sentence_queue.lock:
+                self.segmenter.first_fragment_chars = self.first_fragment_chars
+                self.segmenter.min_chars = self.min_sentence_chars
+        tracer.set_info(**decision)
+        if self.dbg_log:
+            print(f"Fragment sizes: {decision}")
+
+    def interrupt(self) -> str:
+        """
+        Stop the current turn right away (barge-in): queued sentences and
+        buffered audio are dropped, audio still being synthesized is
+        discarded by its stale generation and waiters are released.
+        Returns the assistant text that was actually heard, with emotion tags.
+        """
+        with self.turn_lock:
+            consumed, written = self.playout.positions()
+            segments = self.turn_segments
+            self.generation += 1
+            self.turn_segments = []
+            self.sentence_queue.clear(self.generation)
+        self.playout.clear()
+        # abort the synthesis of the stale sentence, otherwise the next turn
+        # waits in wait_for_synthesis() until it is done
+        self.stream.stop()
+        self.playback_finished_event.set()
+        return spoken_text(segments, consumed, written)
+
+    def start_tts(self, sentence: Sentence, generation: int):
+        first_chunk = True
+        synthesis = self.synthesis = {
+            "start": time.perf_counter(),
+            "first_chunk": 0.0,
+            "bytes": 0,
+            "blocked": 0.0,  # time spent waiting for room in the playout buffer
+        }
 
-    def start_tts(self):
         def on_audio_chunk(chunk):
-            with self.chunk_lock:
-                self.chunk_queue.put(chunk)
+            nonlocal first_chunk
+            if generation != self.generation:
+                return  # stale audio from a previous or interrupted turn
+            if first_chunk:
+                first_chunk = False
+                synthesis["first_chunk"] = time.perf_counter() - synthesis["start"]
+                self.on_sentence_audio_start(sentence)
+            synthesis["bytes"] += len(chunk)
+            # blocks while the playout buffer is full (backpressure)
+            write_start = time.perf_counter()
+            self.playout.write(chunk)
+            synthesis["blocked"] += time.perf_counter() - write_start
+
+        if self.segmenter is not None:
+            # a segmented unit is complete and not split again, the stream
+            # synthesizes it as soon as it is fed, without look-ahead context
+            self.stream.play_async(
+                fast_sentence_fragment=False,
+                log_synthesized_text=True,
+                muted=True,
+                on_audio_chunk=on_audio_chunk,
+                minimum_sentence_length=0,
+                minimum_first_fragment_length=0,
+                context_size=0,
+                sentence_fragment_delimiters="",
+            )
+            return
 
         self.stream.play_async(
             fast_sentence_fragment=True,
             log_synthesized_text=True,
             muted=True,
             on_audio_chunk=on_audio_chunk,
-            minimum_sentence_length=10,
-            minimum_first_fragment_length=10,
+            minimum_sentence_length=self.min_sentence_chars,
+            minimum_first_fragment_length=self.first_fragment_chars,
             context_size=5,
             sentence_fragment_delimiters=".?!;:,\n…)]}。",
             force_first_fragment_after_words=999999,
         )
 
-    def tts_play_sentence(self, sentence: Sentence):
+    def tts_play_sentence(self, sentence: Sentence, generation: int):
+        measured_text = None
         if sentence.get_finished():
             sentence_text = sentence.get_text()
             if self.dbg_log:
-                print(f"tts_play_sentence complete sentence found, playing {sentence_text}")
+                print(f"tts_play_sentence complete sentence found, playing {sentence_text} (final: {sentence.final})")
             self.stream.feed(sentence_text)
             if self.dbg_log:
                 print("tts_play_sentence [STARTPLAY]")
             if not self.stream.is_playing():
-                self.start_tts()
+                self.start_tts(sentence, generation)
+                # the whole text was there from the start, the timing is the engine's own
+                measured_text = sentence_text
         else:
             if self.dbg_log:
                 print(f"tts_play_sentence running sentence found, realtime playing")
-            buffer = BufferStream()
-            last_text = ""
+            buffer = BufferStream(self.coalesce_window)
+            offset = 0
+            finished = False
             if self.dbg_log:
                 print(f"ID: {sentence.id}")
                 print(f"EMOTION: {sentence.emotion}")
 
-            while not sentence.get_finished():
-                current_text = sentence.get_text()
-                if len(current_text) > len(last_text):
-                    new_text = current_text[len(last_text):]
-                    buffer.add(new_text)
+            while not finished and generation == self.generation:
+                # returns as soon as the LLM thread appends text
+                fragments, offset, finished = sentence.read_since(offset, timeout=0.1)
+                if fragments:
+                    buffer.add(''.join(fragments))
                     if not self.stream.is_playing():
                         self.stream.feed(buffer.gen())
-                        self.start_tts()
-                last_text = current_text
-                time.sleep(0.01)
+                        self.start_tts(sentence, generation)
             if self.dbg_log:
                 print(" - feed finished")
             buffer.stop()
+        self.wait_for_synthesis()
+        if measured_text is not None:
+            self.record_synthesis(measured_text, generation)
+
+        if not self.lookahead:
+            # strictly sequential: let this sentence play out before the next
+            played_event = threading.Event()
+            self.playout.add_marker(played_event)
+            while not played_event.wait(0.1):
+                if self.stop_event.is_set() or generation != self.generation:
+                    break
+
+    def record_synthesis(self, text: str, generation: int):
+        synthesis = self.synthesis
+        if self.fragment_sizer is None or synthesis is None or generation != self.generation:
+            return
+        audio_seconds = synthesis["bytes"] / (self.playout.frame_size * self.pySampleRate)
+        synthesis_seconds = time.perf_counter() - synthesis["start"] - synthesis["blocked"]
+        self.fragment_sizer.add_synthesis(len(text), audio_seconds, synthesis_seconds, synthesis["first_chunk"])
+
+    def wait_for_synthesis(self):
+        """Block until the stream has delivered the last chunk of the sentence."""
+        play_thread = self.stream.play_thread
+        if play_thread is not None and play_thread.is_alive():
+            play_thread.join()
         while self.stream.is_playing():
-            time.sleep(0.01)
+            time.sleep(0.001)
+
+    def on_sentence_audio_start(self, sentence: Sentence):
+        self.turn_segments.append((self.playout.bytes_written, sentence))
+        if not self.turn_audio_started:
+            self.turn_audio_started = True
+            tracer.mark("first_audio_chunk")
+            self.trace_playout("first_sample_played", self.generation,
+                               self.playout.bytes_written + self.playout.frame_size)
+            return
+        # audio still queued when the next sentence's first chunk arrives is
+        # the slack that hides this sentence's synthesis latency
+        slack = self.playout.buffered_seconds()
+        self.lookahead_stats["handovers"] += 1
+        self.lookahead_stats["last_slack"] = slack
+        if self.fragment_sizer is not None:
+            self.fragment_sizer.add_handover(slack)
+        if slack == 0.0:
+            self.lookahead_stats["gaps"] += 1
+        if self.dbg_log:
+            print(f"Sentence audio start, {slack:.2f}s of audio buffered ahead")
+
+    def trace_playout(self, name: str, generation: int, position=None):
+        """Mark name in the turn trace when the playout reaches position."""
+        latency = self.playout.output_latency()
+
+        def on_played():
+            # clear() after an interrupt releases callbacks too, ignore those
+            if generation == self.generation:
+                tracer.mark(name, time.perf_counter() + latency)
+
+        self.playout.add_callback(on_played, position)
 
     def tts_sentence_worker_thread(self):
+        marked_generation = 0
         while not self.stop_event.is_set():
+            # blocks until a sentence is available, the turn is drained or shutdown
             sentence = self.sentence_queue.get_sentence()
+            with self.turn_lock:
+                generation = self.generation
+                playback_finished_event = self.playback_finished_event
+                drained = self.sentence_queue.drained_generation == generation
+
+            if sentence is None:
+                if drained and marked_generation != generation:
+                    # everything of this turn is synthesized, the completion
+                    # event fires when the playout consumed the last sample
+                    self.playout.add_marker(playback_finished_event)
+                    self.trace_playout("last_sample_played", generation)
+                    marked_generation = generation
+                continue
+
+            if sentence.generation != generation:
+                continue  # queued before an interrupt or a new turn
 
-            if sentence:
-                emotion = sentence.emotion
-                if not emotion or emotion == "None":
-                    emotion = "neutral"
-                emotion_file = emotion + ".wav"
-                path = os.path.join(self.references_folder, emotion_file)
-                if os.path.exists(path):
-                    if self.dbg_log:
-                        print(f"Setting TTS Emotion path: {path}")
-                    self.engine.set_cloning_reference(path)
-                else:
-                    if self.dbg_log:
-                        print(f"No emotion found for path: {path}")
-                    path = os.path.join(self.references_folder, "neutral.wav")
-                    if os.path.exists(path):
-                        if self.dbg_log:
-                            print(f"Setting neutral: {path}")
-                        self.engine.set_cloning_reference(path)
-                    else:
-                        if self.dbg_log:
-                            print(f"CANT FIND EMOTIONS")
-
-                if self.dbg_log:
-                    print(f"TTS found a sentence, running: {sentence.get_finished()}")
-                    print(f" - finished: {sentence.get_finished()}")
-                    print(f" - retrieved: {sentence.retrieved}")
-                    print(f" - popped: {sentence.popped}")
-                    print(f" - id: {sentence.id}")
-                self.tts_play_sentence(sentence)
-            
-            time.sleep(0.01)
-
-    def start_threads(self):
-        self.tts_sentence_thread = threading.Thread(target=self.tts_sentence_worker_thread)
-        self.tts_sentence_thread.daemon = True
-        self.tts_sentence_thread.start()
-
-        self.tts_play_thread = threading.Thread(target=self.tts_play_worker_thread)
-        self.tts_play_thread.daemon = True
-        self.tts_play_thread.start()
+            self.set_emotion(sentence.emotion)
+
+            if self.dbg_log:
+                print(f"TTS found a sentence, running: {sentence.get_finished()}")
+                print(f" - finished: {sentence.get_finished()}")
+                print(f" - retrieved: {sentence.retrieved}")
+                print(f" - popped: {sentence.popped}")
+                print(f" - id: {sentence.id}")
+            # go straight to the next sentence while the current one is still playing
+            self.tts_play_sentence(sentence, generation)
+
+    def set_emotion(self, emotion):
+        if not emotion or emotion == "None":
+            emotion = "neutral"
+        latents = self.latent_cache.get(emotion)
+        if latents is None:
+            if self.dbg_log:
+                print(f"CANT FIND EMOTIONS")
+            return
+        if latents is self.active_latents:
+            # same voice as the previous sentence, nothing to reload
+            self.emotion_stats["skipped"] += 1
+            self.emotion_stats["last_switch_time"] = 0.0
+            self.trace_emotion_switch(False, 0.0)
+            return
+
+        if self.dbg_log:
+            print(f"Setting TTS Emotion: {latents.emotion} ({latents.reference})")
+        start_time = time.time()
+        # the engine's worker process loads the latents from the .json itself
+        self.engine.set_cloning_reference(latents.reference)
+        switch_time = time.time() - start_time
+        self.active_latents = latents
+
+        self.emotion_stats["switches"] += 1
+        self.emotion_stats["switch_time_total"] += switch_time
+        self.emotion_stats["last_switch_time"] = switch_time
+        self.trace_emotion_switch(True, switch_time)
+        if self.dbg_log:
+            print(f"Emotion switch took {switch_time * 1000:.1f}ms")
+
+    def trace_emotion_switch(self, switched: bool, switch_time: float):
+        """Count a voice switch or a skipped one in the turn trace."""
+        stats = self.turn_emotion_stats
+        if not stats:
+            return  # before the first turn
+        if switched:
+            stats["emotion_switches"] += 1
+            stats["emotion_switch_time"] = round(stats["emotion_switch_time"] + switch_time, 4)
+        else:
+            stats["emotion_skips"] += 1
+        tracer.set_info(last_switch_time=round(switch_time, 4), **stats)
 
     def add_text(self, text):
         self.sentence_queue.add_text(text)
@@ -171,23 +397,42 @@ class TTSHandler:
     def finish_current_sentence(self):
         self.sentence_queue.finish_current_sentence()
 
+    def finish_turn(self):
+        """Signal that all text of the current turn has been added."""
+        self.sentence_queue.finish_turn()
+
+    def wait_for_playback(self, timeout=None) -> bool:
+        """
+        Block until the last synthesized sample of the turn has been played.
+        Returns False on timeout.
+        """
+        if not self.playback_finished_event.wait(timeout):
+            return False
+        # the device still has to play out what it was just handed
+        time.sleep(self.playout.output_latency())
+        return True
+
     def is_empty(self):
         return self.sentence_queue.is_empty()
 
     def is_playing(self):
         return self.stream.is_playing()
     
-    def shutdown_pyaudio(self):
-        if self.pystream is not None:
-            self.pystream.stop_stream()
-            self.pystream.close()
-        if self.pyaudio_instance is not None:
-            self.pyaudio_instance.terminate()
+    def get_playout_stats(self):
+        return self.playout.get_stats() if self.playout else {}
 
     def shutdown(self):
         self.stop_event.set()
-        print("Waiting for sentence thread finished")
-        self.tts_sentence_thread.join()
-        print("Waiting for play thread finished")
-        self.tts_play_thread.join()
+        self.sentence_queue.close()  # wakes the worker blocked on the queue
+        if self.playout is not None:
+            if self.dbg_log:
+                print(f"Playout stats: {self.playout.get_stats()}")
+            # releases a synthesis callback blocked on a full buffer
+            self.playout.close()
+        if self.tts_sentence_thread is not None:
+            if self.dbg_log:
+                print("Waiting for sentence thread finished")
+            self.tts_sentence_thread.join()
+            self.tts_sentence_thread = None
+        self.playout = None
         self.engine.shutdown()